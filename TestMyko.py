@@ -7,9 +7,14 @@ import hashlib
 import base64
 import os
 import argparse
+import contextlib
 import getpass
 import uuid
 import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 CLIENT_ID = 'kfi_android'
 REDIRECT_URI = 'kfi-app://loginredirect'
@@ -398,10 +403,152 @@ def anonymize_json(infile):
     return infile
 
 
+class BulkClient:
+    """Logs in once and shares one token and one connection pool across threads.
+
+    Used by the bulk mode to dump every device and to apply a file of commands
+    with bounded concurrency, instead of re-authenticating for every device.
+    """
+
+    # Tokens last 120 seconds
+    token_duration = 110
+
+    def __init__(self, refresh_token, account_id, concurrency):
+        self.refresh_token = refresh_token
+        self.account_id = account_id
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self._token = None
+        self._token_time = 0
+        self._token_lock = threading.Lock()
+
+    def token(self):
+        with self._token_lock:
+            if self._token is None or time.monotonic() - self._token_time > self.token_duration:
+                self._token = get_auth_token_from_refresh_token(self.refresh_token)
+                self._token_time = time.monotonic()
+            return self._token
+
+    def headers(self):
+        return {
+            "user-agent": "Dart/2.15 (dart:io)",
+            "host": SEMANTICS_HOST,
+            "accept-encoding": "gzip",
+            "authorization": "Bearer " + self.token(),
+            "content-type": "application/json; charset=utf-8",
+        }
+
+    def metadevices_url(self):
+        return "https://" + API_HOST + "/v1/accounts/" + self.account_id + "/metadevices"
+
+    def get_metadevices(self):
+        r = self.session.get(self.metadevices_url() + "?expansions=state", headers=self.headers())
+        r.raise_for_status()
+        return r.json()
+
+    def get_state(self, child):
+        r = self.session.get(self.metadevices_url() + "/" + child + "/state", headers=self.headers())
+        r.raise_for_status()
+        return r.json()
+
+    def set_state(self, child, values):
+        date = datetime.datetime.utcnow()
+        utc_time = calendar.timegm(date.utctimetuple()) * 1000
+        for value in values:
+            value.setdefault("lastUpdateTime", utc_time)
+        payload = {"metadeviceId": str(child), "values": values}
+        r = self.session.put(self.metadevices_url() + "/" + child + "/state", json=payload,
+                             headers=self.headers())
+        return r
+
+    def dump_states(self, outfile, per_device=False):
+        """Write one NDJSON record per device.
+
+        By default every state comes from the single expanded metadevices call.
+        With per_device the states are re-read from each device concurrently,
+        a device whose state could not be read gets an "error" in its record.
+        """
+        devices = [lis for lis in self.get_metadevices() if lis.get("typeId") == "metadevice.device"]
+        states = {lis.get("id"): lis.get("state") for lis in devices}
+        errors = {}
+
+        def get_state(child):
+            # One failing device must not abort the whole dump.
+            try:
+                return self.get_state(child)
+            except requests.exceptions.RequestException as ex:
+                errors[child] = str(ex)
+                return None
+
+        if per_device:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                states = dict(zip(states, pool.map(get_state, states)))
+        for lis in devices:
+            device = lis.get("description", {}).get("device", {})
+            record = {
+                "id": lis.get("id"),
+                "deviceId": lis.get("deviceId"),
+                "friendlyName": lis.get("friendlyName"),
+                "model": device.get("model"),
+                "deviceClass": device.get("deviceClass"),
+                "values": (states.get(lis.get("id")) or {}).get("values", []),
+            }
+            if lis.get("id") in errors:
+                record["error"] = errors[lis.get("id")]
+            outfile.write(json.dumps(record, sort_keys=True) + "\n")
+        return len(devices)
+
+    def apply_commands(self, infile, outfile):
+        """Apply NDJSON commands in parallel, writing one result record per device.
+
+        Each line is {"id": ..., "functionClass": ..., "value": ...} with an
+        optional "functionInstance". Commands for the same device are sent
+        together in one request, in file order, and share its result record.
+        """
+        commands = {}
+        for line in infile:
+            if not line.strip():
+                continue
+            command = json.loads(line)
+            value = {"functionClass": command["functionClass"], "value": command["value"]}
+            if command.get("functionInstance"):
+                value["functionInstance"] = command["functionInstance"]
+            commands.setdefault(command["id"], []).append(value)
+
+        def apply(item):
+            child, values = item
+            try:
+                r = self.set_state(child, values)
+                return {"id": child, "values": values, "status": r.status_code}
+            except requests.exceptions.RequestException as ex:
+                return {"id": child, "values": values, "error": str(ex)}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for result in pool.map(apply, commands.items()):
+                outfile.write(json.dumps(result, sort_keys=True) + "\n")
+        return len(commands)
+
+
+def open_output(path):
+    return contextlib.nullcontext(sys.stdout) if path == "-" else open(path, "w")
+
+
 parser = argparse.ArgumentParser(description='Test connection to Myko server')
 
 parser.add_argument('--username', '-u', required=False)
 parser.add_argument('--password', '-p', required=False)
+parser.add_argument('--bulk-dump', metavar='FILE', required=False,
+                    help='write every device state as NDJSON to FILE ("-" for stdout)')
+parser.add_argument('--per-device', action='store_true',
+                    help='with --bulk-dump, re-read each device state concurrently')
+parser.add_argument('--commands', metavar='FILE', required=False,
+                    help='apply the NDJSON commands in FILE, results go to --results')
+parser.add_argument('--results', metavar='FILE', default='-',
+                    help='where to write --commands results as NDJSON (default stdout)')
+parser.add_argument('--concurrency', type=int, default=8,
+                    help='maximum parallel requests in bulk mode (default 8)')
 args = parser.parse_args()
 user = input('Myko Username: ') if args.username is None else args.username
 passwd = getpass.getpass(prompt='Myko Password: ', stream=None) if args.password is None else args.password
@@ -410,7 +557,18 @@ obtained_refresh_token = get_refresh_code(user, passwd)
 
 obtained_account_id = get_account_id(obtained_refresh_token)
 
-get_child_id(obtained_refresh_token, obtained_account_id, None, only_print_anonymized_json=True)
+if args.bulk_dump or args.commands:
+    client = BulkClient(obtained_refresh_token, obtained_account_id, args.concurrency)
+    if args.bulk_dump:
+        with open_output(args.bulk_dump) as outfile:
+            count = client.dump_states(outfile, per_device=args.per_device)
+        print('Dumped %d devices' % count, file=sys.stderr)
+    if args.commands:
+        with open(args.commands) as infile, open_output(args.results) as outfile:
+            count = client.apply_commands(infile, outfile)
+        print('Sent commands to %d devices' % count, file=sys.stderr)
+else:
+    get_child_id(obtained_refresh_token, obtained_account_id, None, only_print_anonymized_json=True)
 
 #[child, deviceId, model] = get_child_id(obtained_refresh_token, obtained_account_id, None, only_print_anonymized_json=True)
 
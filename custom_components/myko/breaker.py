@@ -0,0 +1,108 @@
+"""Account level circuit breaker for the Myko cloud."""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+
+from .exceptions import MykoCloudUnavailable
+
+_LOGGER = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 5
+RECOVERY_TIMEOUT = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Fail fast while the cloud is down.
+
+    Opens after ``failure_threshold`` consecutive failures. While open every
+    call fails immediately with ``MykoCloudUnavailable``; once
+    ``recovery_timeout`` seconds have passed a single probe request is let
+    through (half open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, recovery_timeout=RECOVERY_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def available(self):
+        """False while the breaker is open or waiting on a probe."""
+        return self._state == CLOSED
+
+    def add_listener(self, listener):
+        """Call ``listener(available)`` whenever availability changes."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def before_call(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    raise MykoCloudUnavailable("Myko cloud unavailable, failing fast")
+                self._state = HALF_OPEN
+            if self._probing:
+                raise MykoCloudUnavailable("Myko cloud unavailable, probe in progress")
+            self._probing = True
+
+    def release(self):
+        """End a call that never reached the cloud, without counting it.
+
+        Frees the probe slot of a half open breaker, so the next call can
+        probe instead of failing with "probe in progress" forever.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state == CLOSED:
+                return
+            self._state = CLOSED
+        _LOGGER.warning("Myko cloud reachable again, closing circuit breaker")
+        self._notify(True)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == OPEN:
+                return
+            if self._state == CLOSED and self._failures < self.failure_threshold:
+                return
+            was_closed = self._state == CLOSED
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+        if was_closed:
+            _LOGGER.warning(
+                "Myko cloud failed %d times in a row, failing fast for %ss",
+                self._failures,
+                self.recovery_timeout,
+            )
+            self._notify(False)
+
+    def _notify(self, available):
+        for listener in list(self._listeners):
+            try:
+                listener(available)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in circuit breaker listener")
@@ -0,0 +1,192 @@
+"""Per-device light capabilities derived from the metadevice description."""
+from __future__ import annotations
+
+from homeassistant.components.light import ColorMode
+
+# Used for lights that come without a functions description, see MykoLight.
+LEGACY_COLOR_MODES = frozenset([ColorMode.RGB, ColorMode.COLOR_TEMP, ColorMode.WHITE])
+LEGACY_MIN_MIREDS = 154
+LEGACY_MAX_MIREDS = 370
+
+
+def _kelvin(value):
+    if isinstance(value, str) and value.endswith("K"):
+        value = value[:-1]
+    return int(value)
+
+
+def _range(function):
+    for value in function.get("values", []):
+        if value.get("range"):
+            return value["range"]
+    return None
+
+
+def timer_ranges(functions):
+    """Device side countdowns in minutes, functionInstance to range.
+
+    These run once, there is no recurring schedule on the device.
+    """
+    return {
+        function.get("functionInstance"): _range(function) or {}
+        for function in functions or []
+        if function.get("functionClass") == "timer"
+    }
+
+
+def encode_timer(ranges, minutes, instance=None):
+    """Return ``((functionClass, functionInstance), value)`` for a countdown.
+
+    Uses the only (or the named) timer of ``ranges``, None if there is none.
+    """
+    if instance is None and ranges:
+        instance = next(iter(ranges))
+    if instance not in ranges:
+        return None
+    timer_range = ranges[instance]
+    value = min(max(int(minutes), timer_range.get("min", 0)), timer_range.get("max", 1440))
+    return ("timer", instance), value
+
+
+class LightCapabilities:
+    """What a light supports and how to encode commands for it.
+
+    Built once from ``description.functions`` so ``turn_on`` and ``update``
+    only do dictionary and table lookups.
+    """
+
+    def __init__(self, functions, legacy=False):
+        by_class = {}
+        for function in functions or []:
+            by_class.setdefault(function.get("functionClass"), function)
+
+        self.has_color_mode = "color-mode" in by_class
+        self.has_rgb = "color-rgb" in by_class
+
+        brightness = by_class.get("brightness")
+        brightness_range = _range(brightness) if brightness else None
+        self.has_brightness = brightness is not None
+        self.brightness_min = brightness_range.get("min", 0) if brightness_range else 0
+        self.brightness_max = brightness_range.get("max", 100) if brightness_range else 100
+
+        # Category lights list every temperature they accept ("3000K"), numeric
+        # ones give a kelvin range and step.
+        self.temperature_choices = None
+        self.temperature_suffix = None
+        self.temperature_step = 1
+        self.min_kelvin = None
+        self.max_kelvin = None
+        temperature = by_class.get("color-temperature")
+        if temperature is not None:
+            if temperature.get("type") == "category":
+                names = [value.get("name") for value in temperature.get("values", [])]
+                if any(isinstance(name, str) and name.endswith("K") for name in names):
+                    self.temperature_suffix = "K"
+                self.temperature_choices = tuple(sorted(_kelvin(name) for name in names))
+                if self.temperature_choices:
+                    self.min_kelvin = self.temperature_choices[0]
+                    self.max_kelvin = self.temperature_choices[-1]
+            else:
+                temperature_range = _range(temperature) or {}
+                self.min_kelvin = temperature_range.get("min")
+                self.max_kelvin = temperature_range.get("max")
+                self.temperature_step = temperature_range.get("step") or 1
+        self.has_color_temp = self.min_kelvin is not None and self.max_kelvin is not None
+
+        # Device side fades, functionInstance ("fade-on", "fade-off") to range.
+        self.fade_ranges = {
+            function.get("functionInstance"): _range(function) or {}
+            for function in functions or []
+            if function.get("functionClass") == "fade-duration"
+        }
+        self.has_fade = bool(self.fade_ranges)
+
+        self.timer_ranges = timer_ranges(functions)
+
+        if legacy:
+            self.supported_color_modes = LEGACY_COLOR_MODES
+            self.has_rgb = self.has_color_mode = self.has_brightness = True
+            self.has_color_temp = True
+        else:
+            modes = set()
+            if self.has_rgb:
+                modes.add(ColorMode.RGB)
+            if self.has_color_temp:
+                modes.add(ColorMode.COLOR_TEMP)
+            if not modes:
+                modes.add(ColorMode.BRIGHTNESS if self.has_brightness else ColorMode.ONOFF)
+            self.supported_color_modes = frozenset(modes)
+
+        if self.min_kelvin and self.max_kelvin:
+            self.min_mireds = 1000000 // self.max_kelvin
+            self.max_mireds = 1000000 // self.min_kelvin
+        elif legacy:
+            self.min_mireds = LEGACY_MIN_MIREDS
+            self.max_mireds = LEGACY_MAX_MIREDS
+        else:
+            self.min_mireds = self.max_mireds = None
+
+        # Device "color-mode" value to HA color mode.
+        if ColorMode.WHITE in self.supported_color_modes:
+            white = ColorMode.WHITE
+        elif ColorMode.COLOR_TEMP in self.supported_color_modes:
+            white = ColorMode.COLOR_TEMP
+        else:
+            white = None
+        self.default_color_mode = (
+            next(iter(self.supported_color_modes))
+            if len(self.supported_color_modes) == 1
+            else white or ColorMode.RGB
+        )
+        self.color_modes = {
+            "color": ColorMode.RGB if self.has_rgb else self.default_color_mode,
+            "white": white or self.default_color_mode,
+        }
+
+        # HA brightness (0..255) to device brightness, clamped to its range.
+        self.brightness_table = tuple(
+            min(max(value * 100 // 255, self.brightness_min), self.brightness_max)
+            for value in range(256)
+        )
+
+        # HA mireds to the encoded device color-temperature value.
+        self.color_temp_table = {}
+        if self.min_mireds is not None and (self.temperature_choices or self.has_color_temp):
+            for mireds in range(self.min_mireds, self.max_mireds + 1):
+                self.color_temp_table[mireds] = self._encode_kelvin(1000000 // mireds)
+
+    def _encode_kelvin(self, kelvin):
+        if self.temperature_choices:
+            kelvin = min(self.temperature_choices, key=lambda choice: abs(choice - kelvin))
+        elif self.min_kelvin is not None:
+            step = self.temperature_step
+            kelvin = self.min_kelvin + round((kelvin - self.min_kelvin) / step) * step
+            kelvin = min(max(kelvin, self.min_kelvin), self.max_kelvin)
+        if self.temperature_suffix is not None:
+            return str(kelvin) + self.temperature_suffix
+        return kelvin
+
+    def encode_brightness(self, brightness):
+        return self.brightness_table[min(max(int(brightness), 0), 255)]
+
+    def encode_color_temp(self, mireds):
+        if not self.color_temp_table:
+            return self._encode_kelvin(1000000 // max(int(mireds), 1))
+        mireds = min(max(int(mireds), self.min_mireds), self.max_mireds)
+        return self.color_temp_table[mireds]
+
+    def encode_fade(self, instance, seconds):
+        """Return the fade-duration value for instance, or None if there is none."""
+        fade_range = self.fade_ranges.get(instance)
+        if fade_range is None:
+            return None
+        step = fade_range.get("step") or 1
+        value = round(float(seconds) / step) * step
+        return min(max(value, fade_range.get("min", 0)), fade_range.get("max", value))
+
+    def encode_timer(self, minutes, instance=None):
+        """See ``encode_timer``."""
+        return encode_timer(self.timer_ranges, minutes, instance)
+
+    def color_mode(self, device_mode):
+        return self.color_modes.get(device_mode, self.default_color_mode)
@@ -0,0 +1,17 @@
+"""Errors raised by the Myko cloud client."""
+
+
+class MykoError(Exception):
+    """Base class for Myko client errors."""
+
+
+class MykoConnectionError(MykoError):
+    """The request could not be completed, e.g. connection refused or reset."""
+
+
+class MykoCloudUnavailable(MykoError):
+    """The circuit breaker is open, the call was not attempted."""
+
+
+class MykoTimeout(MykoConnectionError):
+    """A request or the deadline of a multi-step operation ran out."""
@@ -0,0 +1,184 @@
+"""Dedicated worker pool for blocking Myko cloud calls."""
+from __future__ import annotations
+
+from concurrent.futures import Future
+import itertools
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 64
+
+# Lower runs first.
+PRIORITY_COMMAND = 0
+PRIORITY_POLL = 10
+
+
+def _decrement(counts, serial):
+    if counts[serial] > 1:
+        counts[serial] -= 1
+    else:
+        del counts[serial]
+
+
+class MykoExecutor:
+    """Bounded pool that keeps Myko I/O off Home Assistant's shared executor.
+
+    A slow cloud can then only tie up these ``max_workers`` threads. Jobs
+    submitted with a ``key`` are merged while an identical job is queued or
+    running, callers simply share its future. Jobs submitted with ``shed``
+    are dropped, and resolve to ``None``, once ``max_queue`` jobs are waiting.
+
+    Waiting jobs start in ``priority`` order, so user commands overtake
+    background polls. Jobs sharing a ``serial`` key (the device) never run at
+    the same time and start in submission order within a priority, and a
+    poll is held back while a command for its device is queued or running.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, name="myko"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._name = name
+        self._queue = []
+        self._sequence = itertools.count()
+        self._pending = {}
+        # serial key -> number of running jobs / queued or running commands
+        self._busy = {}
+        self._commands = {}
+        self._threads = []
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "merged": 0,
+            "shed": 0,
+            "max_queue_depth": 0,
+        }
+
+    def submit(
+        self, fn, *args, key=None, shed=False, priority=PRIORITY_COMMAND, serial=None, **kwargs
+    ):
+        """Queue ``fn(*args, **kwargs)`` and return a ``concurrent.futures.Future``."""
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Myko executor is shut down")
+            if key is not None and key in self._pending:
+                self._stats["merged"] += 1
+                return self._pending[key]
+            future = Future()
+            if shed and len(self._queue) >= self.max_queue:
+                self._stats["shed"] += 1
+                _LOGGER.debug("Myko executor queue full, shedding %s", key or fn)
+                future.set_result(None)
+                return future
+            if key is not None:
+                self._pending[key] = future
+            self._queue.append(
+                (priority, next(self._sequence), future, key, serial, fn, args, kwargs)
+            )
+            if serial is not None and priority <= PRIORITY_COMMAND:
+                self._commands[serial] = self._commands.get(serial, 0) + 1
+            self._stats["submitted"] += 1
+            self._stats["max_queue_depth"] = max(
+                self._stats["max_queue_depth"], len(self._queue)
+            )
+            if (
+                len(self._threads) < self.max_workers
+                and len(self._queue) > len(self._threads) - self._running
+            ):
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"{self._name}_{len(self._threads)}",
+                    daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify_all()
+            return future
+
+    def _next_job(self):
+        """Pop the most urgent job that may start now, or return ``None``."""
+        best = None
+        for job in self._queue:
+            priority, sequence, _, _, serial, _, _, _ = job
+            if serial is not None:
+                if self._busy.get(serial):
+                    continue
+                if priority > PRIORITY_COMMAND and self._commands.get(serial):
+                    continue
+            if best is None or (priority, sequence) < best[:2]:
+                best = job
+        if best is None:
+            return None
+        self._queue.remove(best)
+        return best
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while True:
+                    job = self._next_job() if self._queue else None
+                    if job is not None or (self._shutdown and not self._queue):
+                        break
+                    self._condition.wait()
+                if job is None:
+                    return
+                priority, _, future, key, serial, fn, args, kwargs = job
+                self._running += 1
+                if serial is not None:
+                    self._busy[serial] = self._busy.get(serial, 0) + 1
+            if not future.set_running_or_notify_cancel():
+                self._finish(job, None)
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as ex:  # pylint: disable=broad-except
+                self._finish(job, "failed")
+                future.set_exception(ex)
+            else:
+                self._finish(job, "completed")
+                future.set_result(result)
+
+    def _finish(self, job, outcome):
+        # Forget the key before resolving, so a new submission never merges
+        # into a job that has already finished.
+        priority, _, future, key, serial, _, _, _ = job
+        with self._condition:
+            self._running -= 1
+            if key is not None and self._pending.get(key) is future:
+                del self._pending[key]
+            if serial is not None:
+                _decrement(self._busy, serial)
+                if priority <= PRIORITY_COMMAND:
+                    _decrement(self._commands, serial)
+            if outcome is not None:
+                self._stats[outcome] += 1
+            self._condition.notify_all()
+
+    def commands_pending(self, serial):
+        """True while a command for ``serial`` is queued or running."""
+        with self._condition:
+            return bool(self._commands.get(serial))
+
+    def stats(self):
+        """Queue depth and counters, for diagnostics."""
+        with self._condition:
+            return {
+                "workers": len(self._threads),
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queue_depth": len(self._queue),
+                "commands_pending": sum(self._commands.values()),
+                **self._stats,
+            }
+
+    def shutdown(self):
+        """Stop accepting work; workers exit once the queue is drained."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
@@ -0,0 +1,104 @@
+"""Hedged requests: a late idempotent call gets a duplicate, the first answer wins."""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+HEDGE_PERCENTILE = 90
+# At most this share of calls gets a duplicate, however slow the cloud is.
+HEDGE_BUDGET = 0.1
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.1
+HEDGE_WORKERS = 8
+
+
+class Hedger:
+    """Send a duplicate of a call that runs past the usual latency.
+
+    The delay is the ``percentile`` of the last ``window`` call latencies, so
+    only the slow tail is hedged. Until ``min_samples`` latencies are known
+    calls are not hedged, and duplicates are capped at ``budget`` of all
+    calls. Only use it for idempotent calls, the slower copy still reaches
+    the cloud.
+    """
+
+    def __init__(
+        self,
+        percentile=HEDGE_PERCENTILE,
+        budget=HEDGE_BUDGET,
+        window=HEDGE_WINDOW,
+        min_samples=HEDGE_MIN_SAMPLES,
+        max_workers=HEDGE_WORKERS,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="myko_hedge")
+        self._stats = {"calls": 0, "hedged": 0, "hedge_won": 0}
+
+    def delay(self):
+        """Seconds to wait before hedging, None while too few latencies are known."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, len(latencies) * self.percentile // 100)
+        return max(latencies[index], HEDGE_MIN_DELAY)
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        result = fn()
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _take_budget(self):
+        with self._lock:
+            if self._stats["hedged"] + 1 > self.budget * self._stats["calls"]:
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def call(self, fn, duplicate=None):
+        """Return ``fn()``, or the result of ``duplicate()`` (default ``fn``) if that is first."""
+        with self._lock:
+            self._stats["calls"] += 1
+        delay = self.delay()
+        if delay is None:
+            return self._timed(fn)
+        first = self._pool.submit(self._timed, fn)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._take_budget():
+            return first.result()
+
+        _LOGGER.debug("Myko call slower than %.2fs, hedging", delay)
+        second = self._pool.submit(self._timed, duplicate or fn)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        with self._lock:
+                            self._stats["hedge_won"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["delay"] = self.delay()
+        return stats
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
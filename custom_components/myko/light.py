@@ -1,58 +1,130 @@
 """Platform for light integration."""
 from __future__ import annotations
 
+import asyncio
+import functools
 import logging
-
+import math
+import time
+from typing import Any, Final
+
+from .capabilities import LightCapabilities
+from .exceptions import MykoCloudUnavailable, MykoError
+from .executor import (
+    DEFAULT_MAX_QUEUE,
+    DEFAULT_WORKERS,
+    PRIORITY_COMMAND,
+    PRIORITY_POLL,
+    MykoExecutor,
+)
 from .myko import Myko
+from .profiling import SPANS, profile_polls
+from .ratelimit import DEFAULT_RATE, RateLimiter
+from .transport import create_transport
 import voluptuous as vol
 
 # Import the device class from the component that you want to support
-from homeassistant.helpers import config_validation as cv, entity_platform, service
+from homeassistant.helpers import (
+    config_validation as cv,
+    discovery,
+    entity_platform,
+    entity_registry as er,
+)
 from homeassistant.components.light import (
     ATTR_BRIGHTNESS,
+    ATTR_COLOR_MODE,
     ATTR_RGB_COLOR,
     ATTR_WHITE,
     ATTR_COLOR_TEMP,
+    ATTR_TRANSITION,
     PLATFORM_SCHEMA,
     ColorMode,
-    COLOR_MODES_COLOR,
     LightEntity,
+    LightEntityFeature,
+)
+from homeassistant.const import (
+    CONF_PASSWORD,
+    CONF_USERNAME,
+    EVENT_HOMEASSISTANT_STOP,
+    STATE_OFF,
+    STATE_ON,
 )
-from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
 from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.exceptions import HomeAssistantError, PlatformNotReady
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.event import track_time_interval
+from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+from homeassistant.util import dt as dt_util
 from datetime import timedelta
 
-# Import exceptions from the requests module
-import requests.exceptions
-
 SCAN_INTERVAL = timedelta(seconds=60)
+DISCOVERY_INTERVAL = timedelta(minutes=5)
 BASE_INTERVAL = timedelta(seconds=60)
+DOMAIN: Final = "myko"
 SERVICE_NAME = "send_command"
+SERVICE_PROFILE = "profile"
+SERVICE_TIMING = "timing"
+SERVICE_SNAPSHOT = "snapshot"
+SERVICE_RESTORE = "restore"
+SERVICE_SET_TIMER = "set_timer"
+ATTR_SCENE_ID: Final = "scene_id"
+
+# Lights without fade-duration fade by stepping brightness, in at most this
+# many commands spaced at least this many seconds apart.
+TRANSITION_MAX_STEPS = 10
+TRANSITION_STEP_INTERVAL = 1.0
 _LOGGER = logging.getLogger(__name__)
 
 CONF_DEBUG: Final = "debug"
-
-# Validation of the user's configuration
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+CONF_HTTP2: Final = "http2"
+CONF_TIMEOUT: Final = "timeout"
+CONF_WORKERS: Final = "workers"
+CONF_MAX_QUEUE: Final = "max_queue"
+CONF_GROUPS: Final = "groups"
+CONF_ACCOUNTS: Final = "accounts"
+CONF_RATE_LIMIT: Final = "rate_limit"
+CONF_HEDGE: Final = "hedge"
+
+ACCOUNT_SCHEMA = vol.Schema(
     {
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
-        vol.Required(CONF_DEBUG, default=False): cv.boolean,
     }
 )
 
+# Validation of the user's configuration
+PLATFORM_SCHEMA = vol.All(
+    PLATFORM_SCHEMA.extend(
+        {
+            vol.Inclusive(CONF_USERNAME, "account"): cv.string,
+            vol.Inclusive(CONF_PASSWORD, "account"): cv.string,
+            vol.Optional(CONF_ACCOUNTS): vol.All(cv.ensure_list, [ACCOUNT_SCHEMA]),
+            vol.Optional(CONF_RATE_LIMIT, default=DEFAULT_RATE): vol.All(
+                vol.Coerce(float), vol.Range(min=0.1)
+            ),
+            vol.Required(CONF_DEBUG, default=False): cv.boolean,
+            vol.Optional(CONF_HTTP2, default=False): cv.boolean,
+            vol.Optional(CONF_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=1)),
+            vol.Optional(CONF_WORKERS, default=DEFAULT_WORKERS): vol.All(
+                vol.Coerce(int), vol.Range(min=1)
+            ),
+            vol.Optional(CONF_MAX_QUEUE, default=DEFAULT_MAX_QUEUE): vol.All(
+                vol.Coerce(int), vol.Range(min=1)
+            ),
+            vol.Optional(CONF_GROUPS, default=False): cv.boolean,
+            vol.Optional(CONF_HEDGE, default=False): cv.boolean,
+        }
+    ),
+    cv.has_at_least_one_key(CONF_USERNAME, CONF_ACCOUNTS),
+)
+
 def _brightness_to_hass(value):
     if value is None:
         value = 0
     return int(value) * 255 // 100
 
 
-def _brightness_to_myko(value):
-    return value * 100 // 255
-
-
 def _convert_color_temp(value):
     if isinstance(value, str) and value.endswith("K"):
         value = value[:-1]
@@ -61,29 +133,303 @@ def _convert_color_temp(value):
     return 1000000 // int(value)
 
 
-def setup_platform(
-    hass: HomeAssistant,
-    config: ConfigType,
-    add_entities: AddEntitiesCallback,
-    discovery_info: DiscoveryInfoType | None = None,
-) -> None:
-    """Set up the Awesome Light platform."""
+def _discover_groups(myko, lights):
+    """Create a group light for every home and room that contains lights."""
+    by_id = {light.unique_id: light for light in lights}
+    groups = {
+        groupId: (typeId, friendlyName, children)
+        for groupId, typeId, friendlyName, children in myko.discoverGroups()
+    }
 
-    # Assign configuration variables.
-    # The configuration check takes care they are present.
+    def members(metadevice_id, seen):
+        if metadevice_id in seen:
+            return []
+        seen.add(metadevice_id)
+        if metadevice_id in by_id:
+            return [by_id[metadevice_id]]
+        found = []
+        for child in groups.get(metadevice_id, (None, None, []))[2]:
+            found.extend(members(child, seen))
+        return found
+
+    for groupId, (typeId, friendlyName, children) in groups.items():
+        group_members = members(groupId, set())
+        if group_members:
+            _LOGGER.debug("%s %s: %d lights", typeId, friendlyName, len(group_members))
+            yield MykoGroupLight(myko, friendlyName, groupId, group_members)
+
+
+def _shared(hass: HomeAssistant, config: ConfigType):
+    """Connection pools, rate limiter and service shared by every account."""
+    data = hass.data.get(DOMAIN)
+    if data is not None:
+        return data
+    data = hass.data[DOMAIN] = {
+        "transports": {},
+        "rate_limiter": RateLimiter(config[CONF_RATE_LIMIT]),
+        "accounts": {},
+        "entities": [],
+        "scenes": {},
+    }
 
-    username = config[CONF_USERNAME]
-    password = config.get(CONF_PASSWORD)
-    debug = config.get(CONF_DEBUG)
-    try:
-        myko = Myko(username, password)
-    except requests.exceptions.ReadTimeout as ex:
-        raise PlatformNotReady(
-            f"Connection error while connecting to myko: {ex}"
-        ) from ex
+    def shutdown(event):
+        for account in data["accounts"].values():
+            account["executor"].shutdown()
+            account["myko"].shutdown()
+        for transport in data["transports"].values():
+            transport.close()
+
+    hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, shutdown)
+
+    async def my_service(call: ServiceCall) -> None:
+        """My first service."""
+        _LOGGER.info("Received data" + str(call.data))
+        name = SERVICE_NAME
+        entity_ids = call.data["entity_id"]
+        functionClass = call.data["functionClass"]
+        value = call.data["value"]
+
+        for entity_id in entity_ids:
+            _LOGGER.info("entity_id: " + str(entity_id))
+            for i in data["entities"]:
+                if i.entity_id == entity_id:
+                    _LOGGER.info("Found Entity")
+                    await i.async_send_command(functionClass, value)
+
+    # Register our service with Home Assistant.
+    hass.services.register(DOMAIN, SERVICE_NAME, my_service)
+
+    async def profile_service(call: ServiceCall) -> None:
+        """Profile a few poll cycles of every account into the config directory.
+
+        Each account's poll runs on its own executor, like MykoPoller.schedule
+        does, one account after the other so their reports do not mix.
+        """
+        started = int(time.time())
+        for index, account in enumerate(data["accounts"].values()):
+            path = hass.config.path(f"myko_profile_{started}_{index}.txt")
+            await asyncio.wrap_future(
+                account["executor"].submit(
+                    profile_polls,
+                    [account["poller"].poll],
+                    call.data["cycles"],
+                    path,
+                    call.data["memory"],
+                    priority=PRIORITY_POLL,
+                )
+            )
+
+    hass.services.register(
+        DOMAIN,
+        SERVICE_PROFILE,
+        profile_service,
+        schema=vol.Schema(
+            {
+                vol.Optional("cycles", default=3): vol.All(
+                    vol.Coerce(int), vol.Range(min=1, max=100)
+                ),
+                vol.Optional("memory", default=True): cv.boolean,
+            }
+        ),
+    )
+
+    def timing_service(call: ServiceCall) -> None:
+        """Switch the Myko timing spans on or off, logging what was collected."""
+        if SPANS.enabled and not call.data["enabled"]:
+            _LOGGER.info("Myko timing spans:\n%s", SPANS.format())
+        elif call.data["enabled"] and not SPANS.enabled:
+            SPANS.reset()
+        SPANS.enabled = call.data["enabled"]
+
+    hass.services.register(
+        DOMAIN,
+        SERVICE_TIMING,
+        timing_service,
+        schema=vol.Schema({vol.Required("enabled"): cv.boolean}),
+    )
+
+    def scene_lights(entity_ids=None):
+        """The lights of every account, or only entity_ids, grouped by account."""
+        accounts = {}
+        for entity in data["entities"]:
+            if isinstance(entity, MykoLight) and (
+                not entity_ids or entity.entity_id in entity_ids
+            ):
+                accounts.setdefault(entity._myko, []).append(entity)
+        return accounts
+
+    async def snapshots(accounts, children=None):
+        """One bulk fetch per account, all accounts at once."""
+        jobs = []
+        for myko, lights in accounts.items():
+            wanted = [light.unique_id for light in lights]
+            if children is not None:
+                wanted = [child for child in wanted if child in children]
+            jobs.append(
+                asyncio.wrap_future(lights[0]._executor.submit(myko.snapshot, wanted))
+            )
+        results = await asyncio.gather(*jobs)
+        scene = {}
+        for result in results:
+            scene.update(result)
+        return scene
+
+    async def snapshot_service(call: ServiceCall) -> None:
+        """Capture the lights, or the given ones, as a scene."""
+        accounts = scene_lights(call.data.get("entity_id"))
+        data["scenes"][call.data[ATTR_SCENE_ID]] = await snapshots(accounts)
+
+    async def restore_service(call: ServiceCall) -> None:
+        """Bring the lights of a scene back, sending only what differs."""
+        scene = data["scenes"].get(call.data[ATTR_SCENE_ID])
+        if scene is None:
+            raise HomeAssistantError(f"No Myko scene {call.data[ATTR_SCENE_ID]}")
+        accounts = scene_lights()
+        current = await snapshots(accounts, scene)
+        diff = Myko.scene_diff(scene, current)
+        lights = {light.unique_id: light for lights in accounts.values() for light in lights}
+        results = await asyncio.gather(
+            *(
+                lights[child].async_set_state(values)
+                for child, values in diff.items()
+                if child in lights and lights[child].available
+            ),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise HomeAssistantError(
+                f"{len(errors)} of {len(results)} lights failed to restore: {errors[0]}"
+            )
+
+    hass.services.register(
+        DOMAIN,
+        SERVICE_SNAPSHOT,
+        snapshot_service,
+        schema=vol.Schema(
+            {
+                vol.Required(ATTR_SCENE_ID): cv.string,
+                vol.Optional("entity_id"): cv.entity_ids,
+            }
+        ),
+    )
+    hass.services.register(
+        DOMAIN,
+        SERVICE_RESTORE,
+        restore_service,
+        schema=vol.Schema({vol.Required(ATTR_SCENE_ID): cv.string}),
+    )
+
+    async def set_timer_service(call: ServiceCall) -> None:
+        """Start the device side countdown of each entity, one write per entity."""
+        if "minutes" in call.data:
+            minutes = call.data["minutes"]
+        elif "at" in call.data:
+            now = dt_util.now()
+            at = now.replace(
+                hour=call.data["at"].hour,
+                minute=call.data["at"].minute,
+                second=0,
+                microsecond=0,
+            )
+            if at <= now:
+                at += timedelta(days=1)
+            minutes = math.ceil((at - now).total_seconds() / 60)
+        else:
+            raise HomeAssistantError("Either minutes or at is required")
+        # Lights and the switches of outlets and fans.
+        entities = [
+            entity for entity in data["entities"] if entity.entity_id in call.data["entity_id"]
+        ]
+        without = [entity.name for entity in entities if not getattr(entity, "has_timer", False)]
+        if without:
+            raise HomeAssistantError(f"No device timer on {', '.join(without)}")
+        await asyncio.gather(
+            *(
+                entity.async_set_timer(minutes, call.data.get("functionInstance"))
+                for entity in entities
+            )
+        )
+
+    hass.services.register(
+        DOMAIN,
+        SERVICE_SET_TIMER,
+        set_timer_service,
+        schema=vol.Schema(
+            {
+                vol.Required("entity_id"): cv.entity_ids,
+                vol.Exclusive("minutes", "when"): vol.All(
+                    vol.Coerce(int), vol.Range(min=0, max=1440)
+                ),
+                vol.Exclusive("at", "when"): cv.time,
+                vol.Optional("functionInstance"): cv.string,
+            }
+        ),
+    )
+    return data
+
+
+def _setup_account(data, config: ConfigType, username, password):
+    """Log in to one account and create its lights."""
+    http2 = config.get(CONF_HTTP2)
+    transport = data["transports"].get(http2)
+    if transport is None:
+        transport = data["transports"][http2] = create_transport(http2=http2)
+    start = time.perf_counter()
+    myko = Myko(
+        username,
+        password,
+        operation_timeout=config.get(CONF_TIMEOUT),
+        transport=transport,
+        rate_limiter=data["rate_limiter"],
+        hedge=config[CONF_HEDGE],
+    )
+    startup = myko.startup
+
+    # Each account gets its own bounded pool instead of HA's shared executor,
+    # so a slow or failing account cannot hold up the others.
+    executor = MykoExecutor(
+        config[CONF_WORKERS], config[CONF_MAX_QUEUE], name=f"myko{len(data['accounts'])}"
+    )
 
-    entities = []
     _LOGGER.debug("Attempting automatic discovery")
+    with startup.phase("discovery"):
+        devices = list(myko.discoverDeviceIds())
+    with startup.phase("entities"):
+        entities = _create_lights(myko, executor, config, devices)
+    poller = MykoPoller(username, myko, executor, entities)
+    account_discovery = MykoDiscovery(
+        myko, executor, poller, config, data, devices, entities
+    )
+    poller.discovery = account_discovery
+    if entities and config[CONF_GROUPS]:
+        with startup.phase("groups"):
+            groups = list(_discover_groups(myko, entities))
+            poller.add_groups(groups)
+            entities.extend(groups)
+    startup.timings["total"] = round(time.perf_counter() - start, 4)
+    _LOGGER.info("Myko account %s set up: %s", username, startup.format())
+    data["accounts"][username] = {
+        "myko": myko,
+        "executor": executor,
+        "poller": poller,
+        "discovery": account_discovery,
+    }
+    return entities, poller
+
+
+def _is_light(deviceClass, functions) -> bool:
+    """Lights, and dimmer switches: switches with a brightness function."""
+    if deviceClass == "light":
+        return True
+    return deviceClass == "switch" and any(
+        function.get("functionClass") == "brightness" for function in functions or []
+    )
+
+
+def _create_lights(myko, executor, config: ConfigType, devices):
+    """Create a MykoLight for every light in devices (see discoverDeviceIds)."""
+    entities = []
     for [
         childId,
         model,
@@ -91,7 +437,7 @@ def setup_platform(
         deviceClass,
         friendlyName,
         functions,
-    ] in myko.discoverDeviceIds():
+    ] in devices:
         _LOGGER.debug("childId " + childId)
         _LOGGER.debug("Switch on Model " + model)
         _LOGGER.debug("deviceId: " + deviceId)
@@ -99,43 +445,287 @@ def setup_platform(
         _LOGGER.debug("friendlyName: " + friendlyName)
         _LOGGER.debug("functions: " + str(functions))
 
-        if deviceClass == "light":
+        if _is_light(deviceClass, functions):
             entities.append(
                 MykoLight(
                     myko,
                     friendlyName,
-                    debug,
+                    config.get(CONF_DEBUG),
                     childId,
                     model,
                     deviceId,
                     deviceClass,
                     functions,
+                    executor=executor,
                 )
             )
-    if not entities:
-        return
-    add_entities(entities)
+    return entities
 
-    def my_service(call: ServiceCall) -> None:
-        """My first service."""
-        _LOGGER.info("Received data" + str(call.data))
-        name = SERVICE_NAME
-        entity_ids = call.data["entity_id"]
-        functionClass = call.data["functionClass"]
-        value = call.data["value"]
 
-        for entity_id in entity_ids:
-            _LOGGER.info("entity_id: " + str(entity_id))
-            for i in entities:
-                if i.entity_id == entity_id:
-                    _LOGGER.info("Found Entity")
-                    i.send_command(functionClass, value)
+def setup_platform(
+    hass: HomeAssistant,
+    config: ConfigType,
+    add_entities: AddEntitiesCallback,
+    discovery_info: DiscoveryInfoType | None = None,
+) -> None:
+    """Set up the Awesome Light platform."""
 
-    # Register our service with Home Assistant.
-    hass.services.register("myko", "send_command", my_service)
+    # Assign configuration variables.
+    # The configuration check takes care they are present.
+
+    accounts = list(config.get(CONF_ACCOUNTS, []))
+    if CONF_USERNAME in config:
+        accounts.insert(
+            0, {CONF_USERNAME: config[CONF_USERNAME], CONF_PASSWORD: config[CONF_PASSWORD]}
+        )
+
+    data = _shared(hass, config)
+    entities = []
+    pollers = []
+    errors = []
+    for account in accounts:
+        username = account[CONF_USERNAME]
+        if username in data["accounts"]:
+            # Already set up by another platform block or an earlier attempt.
+            _LOGGER.debug("Myko account %s is already set up", username)
+            continue
+        try:
+            account_entities, poller = _setup_account(
+                data, config, username, account[CONF_PASSWORD]
+            )
+        except MykoError as ex:
+            _LOGGER.warning("Myko account %s failed to set up: %s", username, ex)
+            errors.append(ex)
+            continue
+        entities.extend(account_entities)
+        pollers.append(poller)
+
+    if entities:
+        data["entities"].extend(entities)
+        add_entities(entities)
+    for poller in pollers:
+        poller.schedule()
+        track_time_interval(hass, poller.schedule, SCAN_INTERVAL)
+        poller.discovery.start(hass, add_entities)
+    if pollers:
+        # Diagnostic sensors and outlet and fan switches of the new
+        # accounts, fed by the same pollers.
+        for platform in ("sensor", "switch"):
+            discovery.load_platform(
+                hass,
+                platform,
+                DOMAIN,
+                {"usernames": [poller.username for poller in pollers]},
+                config,
+            )
+    if errors:
+        # Accounts that are up stay up, the retry only logs in the rest.
+        raise PlatformNotReady(
+            f"Connection error while connecting to myko: {errors[0]}"
+        ) from errors[0]
+
+
+class MykoPoller:
+    """Polls all devices of one account with a single request per cycle.
 
+    Only entities of devices that changed since the last cycle are updated
+    and written to Home Assistant: the lights, the diagnostic sensors and the
+    groups containing them. Lights and switches with a command queued,
+    running or finished since the poll started are left alone, the command
+    result is newer than what the poll fetched.
+    """
 
-class MykoLight(LightEntity):
+    def __init__(self, username, myko, executor, lights):
+        self.username = username
+        self.discovery = None
+        self._myko = myko
+        self._executor = executor
+        self._entities = {}
+        self._groups = {}
+        self.add_entities(lights)
+
+    def add_entities(self, entities) -> None:
+        """Have ``entity.apply_state(state)`` called when its device changes."""
+        for entity in entities:
+            self._entities.setdefault(entity.childId, []).append(entity)
+
+    def entities(self, childId) -> list:
+        """The entities updated for the device childId."""
+        return list(self._entities.get(childId, []))
+
+    def remove_entities(self, entities) -> None:
+        for entity in entities:
+            if entity in self._entities.get(entity.childId, []):
+                self._entities[entity.childId].remove(entity)
+
+    def add_groups(self, groups) -> None:
+        """Have ``group.aggregate()`` called when one of its members changes."""
+        for group in groups:
+            for childId in group.member_ids:
+                self._groups.setdefault(childId, []).append(group)
+
+    def poll(self) -> None:
+        mark = self._myko.command_mark()
+        try:
+            changed = self._myko.poll_changes(mark=mark)
+        except MykoCloudUnavailable:
+            return
+        except MykoError as ex:
+            _LOGGER.warning("Failed to poll myko: %s", ex)
+            return
+        if self.discovery is not None:
+            self.discovery.check(changed)
+        groups = {}
+        for child, state in changed.items():
+            commanded = self._executor.commands_pending(child) or self._myko.commanded_since(
+                child, mark
+            )
+            for entity in self._entities.get(child, []):
+                # Sensors take no commands, lights and switches do.
+                if commanded and hasattr(entity, "set_state"):
+                    continue
+                entity.apply_state(state)
+                if entity.hass is not None:
+                    entity.schedule_update_ha_state()
+            for group in self._groups.get(child, []):
+                groups[group.unique_id] = group
+        for group in groups.values():
+            group.aggregate()
+            if group.hass is not None:
+                group.schedule_update_ha_state()
+
+    def schedule(self, now=None) -> None:
+        try:
+            self._executor.submit(
+                self.poll, key=("poll",), shed=True, priority=PRIORITY_POLL
+            )
+        except RuntimeError:
+            # Executor shut down, Home Assistant is stopping.
+            pass
+
+
+class MykoDiscovery:
+    """Adds entities for new devices and retires removed ones, without a restart.
+
+    Every ``DISCOVERY_INTERVAL`` the catalog is compared with the previous
+    one. That is free until the cached catalog expires (``CATALOG_TTL``),
+    unless the poller sees a device it does not know, which refreshes the
+    catalog right away. New lights are added here, the entities of the other
+    platforms once they hand over how to create them (``track_entities``).
+    A removed device loses every entity the poller has for it.
+    """
+
+    def __init__(self, myko, executor, poller, config, data, devices, lights):
+        self._myko = myko
+        self._executor = executor
+        self._poller = poller
+        self._config = config
+        self._data = data
+        self._known = {device[0] for device in devices}
+        self._lights = {light.childId: light for light in lights}
+        self._catalog = myko.getCatalog()
+        self._hass = None
+        self._add_entities = None
+        # [create, add_entities, register, devices that got their entities]
+        # per platform, see track_entities.
+        self._platforms = []
+
+    def start(self, hass: HomeAssistant, add_entities: AddEntitiesCallback) -> None:
+        self._hass = hass
+        self._add_entities = add_entities
+        track_time_interval(hass, self.schedule, DISCOVERY_INTERVAL)
+
+    def track_entities(self, create, add_entities, children, register=False) -> None:
+        """Create entities of new devices with ``create(myko, childIds)`` from now on.
+
+        ``children`` already have theirs. With ``register`` the entities are
+        also put in ``hass.data[DOMAIN]["entities"]`` for the services.
+        """
+        self._platforms.append([create, add_entities, register, set(children)])
+
+    def check(self, changed) -> None:
+        """Refresh the catalog when the poll shows devices we have not seen."""
+        if any(child not in self._known for child in changed):
+            self.schedule(refresh=True)
+
+    def schedule(self, now=None, refresh=False) -> None:
+        try:
+            self._executor.submit(
+                self.discover, refresh, key=("discover",), shed=True, priority=PRIORITY_POLL
+            )
+        except RuntimeError:
+            pass
+
+    def discover(self, refresh=False) -> None:
+        try:
+            catalog = self._myko.getCatalog(refresh=refresh)
+            if catalog is self._catalog:
+                return
+            self._catalog = catalog
+            devices = list(self._myko.discoverDeviceIds())
+        except MykoError as ex:
+            _LOGGER.warning("Failed to discover myko devices: %s", ex)
+            return
+        known = self._known
+        self._known = {device[0] for device in devices}
+        gone = known - self._known
+
+        added = _create_lights(
+            self._myko,
+            self._executor,
+            self._config,
+            [device for device in devices if device[0] not in self._lights],
+        )
+        removed = [light for child, light in self._lights.items() if child in gone]
+        # Lights and diagnostic sensors alike.
+        retired = [entity for child in gone for entity in self._poller.entities(child)]
+        for light in added:
+            _LOGGER.info("Myko light %s added", light.name)
+            self._lights[light.childId] = light
+            state = self._myko.get_cached_state(light.childId)
+            if state:
+                light.apply_state(state)
+        for light in removed:
+            _LOGGER.info("Myko light %s removed", light.name)
+            del self._lights[light.childId]
+        self._poller.add_entities(added)
+        self._poller.remove_entities(retired)
+        self._data["entities"].extend(added)
+        for entity in retired:
+            if entity in self._data["entities"]:
+                self._data["entities"].remove(entity)
+        if added:
+            self._add_entities(added)
+        for platform in self._platforms:
+            self._discover_platform(platform, gone)
+        for entity in retired:
+            self._hass.add_job(_async_retire, self._hass, entity)
+
+    def _discover_platform(self, platform, gone) -> None:
+        create, add_entities, register, children = platform
+        children -= gone
+        entities = create(self._myko, [child for child in self._known if child not in children])
+        if not entities:
+            return
+        for entity in entities:
+            _LOGGER.info("Myko %s %s added", type(entity).__name__, entity.name)
+            children.add(entity.childId)
+        self._poller.add_entities(entities)
+        if register:
+            self._data["entities"].extend(entities)
+        add_entities(entities)
+
+
+async def _async_retire(hass: HomeAssistant, entity) -> None:
+    """Drop an entity whose device is gone, from the registry too."""
+    registry = er.async_get(hass)
+    if entity.entity_id and registry.async_get(entity.entity_id):
+        registry.async_remove(entity.entity_id)
+    else:
+        await entity.async_remove()
+
+
+class MykoLight(LightEntity, RestoreEntity):
     """Representation of an Awesome Light."""
 
     def __init__(
@@ -148,6 +738,7 @@ class MykoLight(LightEntity):
         deviceId=None,
         deviceClass=None,
         functions=None,
+        executor=None,
     ) -> None:
         """Initialize an AwesomeLight."""
 
@@ -161,20 +752,23 @@ class MykoLight(LightEntity):
         self._model = model
         self._brightness = None
         self._myko = myko
+        self._executor = executor or MykoExecutor()
         self._deviceId = deviceId
         self._debugInfo = None
 
         # colorMode == 'color' || 'white'
         self._colorMode = None
-        self._colorTemp = None
-        self._min_mireds = None
-        self._max_mireds = None
+        self._color_temp = None
         self._rgbColor = None
-        self._temperature_choices = None
-        self._temperature_suffix = None
 
         self._last_state = None
-        self._skip_state_update = False
+        self._remove_availability_listener = None
+        # True while showing the state restored from before the restart,
+        # until the first poll or command brings the real one.
+        self._stale = False
+        self._updated = False
+        # fade-duration instance -> value to put back after a transition.
+        self._fade_restore = {}
 
         if None in (childId, model, deviceId, deviceClass) or "" in (childId, model, deviceId, deviceClass):
             [
@@ -186,15 +780,10 @@ class MykoLight(LightEntity):
         if functions is None:
             functions = self._myko.getFunctions(self._childId)
 
-        self._supported_color_modes = []
-
         # https://www.castorama.pl/panel-led-goodhome-smart-4600-lm-120-x-30-cm/5063022065582_CAPL.prd
-        if  deviceClass == "light" and self._model == "TBD":
-            self._supported_color_modes.extend(
-                [ColorMode.RGB, ColorMode.COLOR_TEMP, ColorMode.WHITE]
-            )
-            self._max_mireds = 370
-            self._min_mireds = 154
+        # Kept for lights that come without a functions description.
+        legacy = deviceClass == "light" and self._model == "TBD" and not functions
+        self._capabilities = LightCapabilities(functions, legacy=legacy)
 
 
     async def async_setup_entry(hass, entry):
@@ -211,6 +800,45 @@ class MykoLight(LightEntity):
             "send_command",
         )
 
+    async def async_added_to_hass(self) -> None:
+        """Restore the last known state and follow the account circuit breaker."""
+        await super().async_added_to_hass()
+        self._restore(await self.async_get_last_state())
+        self._remove_availability_listener = self._myko.add_availability_listener(
+            lambda available: self.schedule_update_ha_state()
+        )
+
+    def _restore(self, last_state) -> None:
+        """Show the state from before the restart until fresh data arrives."""
+        if self._updated or last_state is None:
+            return
+        if last_state.state not in (STATE_ON, STATE_OFF):
+            return
+        attributes = last_state.attributes
+        self._state = last_state.state
+        if attributes.get(ATTR_BRIGHTNESS) is not None:
+            self._brightness = attributes[ATTR_BRIGHTNESS]
+        if attributes.get(ATTR_COLOR_TEMP) is not None:
+            self._color_temp = _convert_color_temp(attributes[ATTR_COLOR_TEMP])
+        if attributes.get(ATTR_RGB_COLOR) is not None:
+            self._rgbColor = tuple(attributes[ATTR_RGB_COLOR])
+        for device_mode, color_mode in self._capabilities.color_modes.items():
+            if color_mode == attributes.get(ATTR_COLOR_MODE):
+                self._colorMode = device_mode
+                break
+        self._stale = True
+        _LOGGER.debug("Restored %s as %s until the first poll", self._name, self._state)
+
+    async def async_will_remove_from_hass(self) -> None:
+        if self._remove_availability_listener is not None:
+            self._remove_availability_listener()
+            self._remove_availability_listener = None
+
+    @property
+    def available(self) -> bool:
+        """Return False while the Myko cloud is failing or the device is offline."""
+        return self._myko.available and self._myko.device_available(self._childId)
+
     @property
     def name(self) -> str:
         """Return the display name of this light."""
@@ -221,18 +849,25 @@ class MykoLight(LightEntity):
         """Return the display name of this light."""
         return self._childId
 
+    @property
+    def childId(self) -> str:
+        return self._childId
+
     @property
     def color_mode(self) -> ColorMode:
-        if self._colorMode == "color":
-            return ColorMode.RGB
-        if self._colorMode == "white":
-            return ColorMode.WHITE
-        return self._colorMode
+        return self._capabilities.color_mode(self._colorMode)
 
     @property
-    def supported_color_modes(self) -> set[ColorMode]:
+    def supported_color_modes(self) -> frozenset[ColorMode]:
         """Flag supported color modes."""
-        return {*self._supported_color_modes}
+        return self._capabilities.supported_color_modes
+
+    @property
+    def supported_features(self) -> LightEntityFeature:
+        """Transitions are native with fade-duration, else stepped brightness."""
+        if self._capabilities.has_fade or self._capabilities.has_brightness:
+            return LightEntityFeature.TRANSITION
+        return LightEntityFeature(0)
 
     @property
     def brightness(self) -> int or None:
@@ -242,17 +877,19 @@ class MykoLight(LightEntity):
     @property
     def color_temp(self) -> int | None:
         """Return the CT color value in mireds."""
+        if self._color_temp is None:
+            return None
         return _convert_color_temp(self._color_temp)
 
     @property
     def min_mireds(self) -> int or None:
         """Return the coldest color_temp that this light supports."""
-        return self._min_mireds
+        return self._capabilities.min_mireds
 
     @property
     def max_mireds(self) -> int or None:
         """Return the warmest color_temp that this light supports."""
-        return self._max_mireds
+        return self._capabilities.max_mireds
 
     @property
     def is_on(self) -> bool | None:
@@ -262,77 +899,177 @@ class MykoLight(LightEntity):
         else:
             return self._state == "on"
 
+    @property
+    def assumed_state(self) -> bool:
+        """The state is restored from before the restart, not yet confirmed."""
+        return self._stale
+
     def set_state(self, state):
-        self._last_state = self._myko.set_state(self._childId, state)
-        self._skip_state_update = True
+        if not self._myko.device_available(self._childId):
+            raise HomeAssistantError(f"{self._name} is offline")
+        try:
+            self._last_state = self._myko.set_state(self._childId, state)
+        except MykoError as ex:
+            raise HomeAssistantError(f"Failed to update {self._name}: {ex}") from ex
+        # The API returns the new state, polling right after a change is
+        # harmful since the server often still has the old data.
+        if self._last_state:
+            self.apply_state(self._last_state)
 
     def get_state(self):
-        # This function is called right after item changes state. When we update
-        # item state with set_state, API is returning new state. Since this
-        # function is called right after, there is no need to call API for new
-        # state again. In fact its harmful, since often server is not up to date
-        # right after change was requested and may return old data.
-        if self._skip_state_update and self._last_state:
-            self._skip_state_update = False
-        else:
-            self._last_state = self._myko.get_state(self._childId)
-
+        self._last_state = self._myko.get_state(self._childId)
         return self._last_state
 
+    async def _async_run(
+        self, fn, *args, key=None, shed=False, priority=PRIORITY_COMMAND, **kwargs
+    ):
+        """Run a blocking call in the Myko executor, one at a time per light."""
+        return await asyncio.wrap_future(
+            self._executor.submit(
+                fn,
+                *args,
+                key=key,
+                shed=shed,
+                priority=priority,
+                serial=self._childId,
+                **kwargs,
+            )
+        )
+
+    async def async_send_command(self, field_name, field_state) -> None:
+        await self._async_run(self.send_command, field_name, field_state)
+        self.async_write_ha_state()
+
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        capabilities = self._capabilities
+        transition = kwargs.get(ATTR_TRANSITION)
+        if transition and not capabilities.has_fade and capabilities.has_brightness:
+            target = kwargs.get(ATTR_BRIGHTNESS, self._brightness or 255)
+            start = (self._brightness or 0) if self._state == "on" else 0
+            await self._async_step_brightness(start, target, transition, self._state != "on")
+            kwargs[ATTR_BRIGHTNESS] = target
+        await self._async_run(functools.partial(self.turn_on, **kwargs))
+        self.async_write_ha_state()
+
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        capabilities = self._capabilities
+        transition = kwargs.get(ATTR_TRANSITION)
+        restore_brightness = None
+        if (
+            transition
+            and not capabilities.has_fade
+            and capabilities.has_brightness
+            and self._state == "on"
+            and self._brightness
+        ):
+            restore_brightness = self._brightness
+            await self._async_step_brightness(restore_brightness, 0, transition, False)
+        await self._async_run(
+            functools.partial(self.turn_off, restore_brightness=restore_brightness, **kwargs)
+        )
+        self.async_write_ha_state()
+
+    async def _async_step_brightness(self, start, target, transition, power_on) -> None:
+        """Fade by stepping brightness, for lights without fade-duration.
+
+        The caller sends the final command, this sends the steps before it.
+        """
+        steps = min(TRANSITION_MAX_STEPS, int(transition / TRANSITION_STEP_INTERVAL))
+        for step in range(1, steps):
+            brightness = start + (target - start) * step // steps
+            state = {"brightness": self._capabilities.encode_brightness(brightness)}
+            if power_on and step == 1:
+                state["power"] = "on"
+            await self._async_run(self.set_state, state)
+            self.async_write_ha_state()
+            await asyncio.sleep(transition / steps)
+
+    @property
+    def has_timer(self) -> bool:
+        return bool(self._capabilities.timer_ranges)
+
+    async def async_set_timer(self, minutes, instance=None) -> None:
+        """Start the device's own countdown, 0 cancels it."""
+        timer = self._capabilities.encode_timer(minutes, instance)
+        if timer is None:
+            raise HomeAssistantError(f"No device timer {instance or ''} on {self._name}")
+        key, value = timer
+        await self.async_set_state({key: value})
+
+    async def async_set_state(self, state) -> None:
+        """Send state (see Myko.set_state) as one command."""
+        await self._async_run(self.set_state, state)
+        self.async_write_ha_state()
+
+    async def async_update(self) -> None:
+        """Poll in the Myko executor, merging with a poll that is still pending."""
+        await self._async_run(
+            self.update, key=("update", self._childId), shed=True, priority=PRIORITY_POLL
+        )
+
     def send_command(self, field_name, field_state) -> None:
         state = {}
         state[field_name] = field_state
         self.set_state(state)
 
     def turn_on(self, **kwargs: Any) -> None:
+        capabilities = self._capabilities
         state = {}
-        if self._state == "off":
+        if self._state == "off" or self._stale:
             state["power"] = "on"
 
-        if ATTR_BRIGHTNESS in kwargs and (
-            ColorMode.ONOFF not in self._supported_color_modes
-        ):
-            brightness = kwargs.get(ATTR_BRIGHTNESS, self._brightness)
-            state["brightness"] = _brightness_to_myko(brightness)
+        if ATTR_BRIGHTNESS in kwargs and capabilities.has_brightness:
+            state["brightness"] = capabilities.encode_brightness(kwargs[ATTR_BRIGHTNESS])
 
-        if ATTR_RGB_COLOR in kwargs and any(
-            mode in COLOR_MODES_COLOR for mode in self._supported_color_modes
-        ):
+        if ATTR_RGB_COLOR in kwargs and capabilities.has_rgb:
             [r,g,b] = kwargs[ATTR_RGB_COLOR]
             state["color-rgb"] = {"color-rgb": {"r": r, "g": g, "b": b}}
-            state["color-mode"] = "color"
+            if capabilities.has_color_mode:
+                state["color-mode"] = "color"
+
+        if ATTR_WHITE in kwargs and (capabilities.has_rgb or capabilities.has_color_temp):
+            if capabilities.has_color_mode:
+                state["color-mode"] = "white"
+            state["brightness"] = capabilities.encode_brightness(kwargs[ATTR_WHITE])
+
+        if ATTR_COLOR_TEMP in kwargs and capabilities.has_color_temp:
+            if capabilities.has_color_mode:
+                state["color-mode"] = "white"
+            state["color-temperature"] = capabilities.encode_color_temp(kwargs[ATTR_COLOR_TEMP])
+            self._color_temp = state["color-temperature"]
 
-        if ATTR_WHITE in kwargs and (
-            any(mode in COLOR_MODES_COLOR for mode in self._supported_color_modes)
-            or ColorMode.COLOR_TEMP in self._supported_color_modes
-        ):
-            state["color-mode"] = "white"
-            brightness = kwargs.get(ATTR_WHITE, self._brightness)
-            state["brightness"] = _brightness_to_myko(brightness)
-
-        if ATTR_COLOR_TEMP in kwargs and (
-            any(mode in COLOR_MODES_COLOR for mode in self._supported_color_modes)
-            or ColorMode.COLOR_TEMP in self._supported_color_modes
-        ):
-            state["color-mode"] = "white"
-            self._color_temp = _convert_color_temp(kwargs[ATTR_COLOR_TEMP])
-            if self._temperature_choices is not None:
-                self._color_temp = self._temperature_choices[
-                    min(
-                        range(len(self._temperature_choices)),
-                        key=lambda i: abs(
-                            self._temperature_choices[i] - self._color_temp
-                        ),
-                    )
-                ]
-            if self._temperature_suffix is not None:
-                state["color-temperature"] = str(self._color_temp) + self._temperature_suffix
-            else:
-                state["color-temperature"] = self._color_temp
+        self._add_fade(state, "fade-on", kwargs.get(ATTR_TRANSITION))
 
         self.set_state(state)
+        self._fade_sent("fade-on", kwargs.get(ATTR_TRANSITION))
         self._state = "on" # lets be optimistic and assume it worked
 
+    def _add_fade(self, state, instance, transition) -> None:
+        """Put the fade-duration for this command into state.
+
+        The device keeps a fade-duration until it is changed, so a command
+        without a transition puts back the value from before the last one
+        (0 if it was not known).
+        """
+        if not self._capabilities.has_fade:
+            return
+        key = ("fade-duration", instance)
+        if transition is None:
+            if instance in self._fade_restore:
+                state[key] = self._fade_restore[instance]
+            return
+        fade = self._capabilities.encode_fade(instance, transition)
+        if fade is None:
+            return
+        if instance not in self._fade_restore:
+            cached = self._myko.get_cached_state(self._childId) or {}
+            self._fade_restore[instance] = cached.get(key, 0)
+        state[key] = fade
+
+    def _fade_sent(self, instance, transition) -> None:
+        if transition is None:
+            self._fade_restore.pop(instance, None)
+
     @property
     def rgb_color(self):
         """Return the rgb value."""
@@ -347,51 +1084,183 @@ class MykoLight(LightEntity):
         attr["devbranch"] = False
 
         attr["debugInfo"] = self._debugInfo
+        attr["stale"] = self._stale
+        if self._debug:
+            attr["executor"] = self._executor.stats()
+            hedging = self._myko.hedge_stats()
+            if hedging is not None:
+                attr["hedging"] = hedging
+            if SPANS.enabled:
+                attr["timing"] = SPANS.report()
+            attr["startup"] = self._myko.startup.timings
 
         return attr
 
-    def turn_off(self, **kwargs: Any) -> None:
+    def turn_off(self, restore_brightness=None, **kwargs: Any) -> None:
         """Instruct the light to turn off."""
-        if self._state == "off":
+        if self._state == "off" and not self._stale:
             return
-        self.set_state({"power": "off"})
+        state = {"power": "off"}
+        self._add_fade(state, "fade-off", kwargs.get(ATTR_TRANSITION))
+        if restore_brightness is not None:
+            # After a stepped fade, so the light comes back at its old level.
+            state["brightness"] = self._capabilities.encode_brightness(restore_brightness)
+        self.set_state(state)
+        self._fade_sent("fade-off", kwargs.get(ATTR_TRANSITION))
         self._state = "off" # lets be optimistic and assume it worked
 
     @property
     def should_poll(self):
-        """Turn on polling"""
-        return True
+        """MykoPoller pushes changes, see there."""
+        return False
 
     def update(self) -> None:
-        """Fetch new state data for this light.
+        """Fetch new state data for this light, on request only.
 
-        This is the only method that should fetch new data for Home Assistant.
+        Offline devices are skipped, MykoPoller notices when they are back.
         """
-        state = self.get_state()
-        self._state = state["power"]
+        if not self._myko.device_available(self._childId):
+            return
+        try:
+            state = self.get_state()
+        except MykoCloudUnavailable:
+            return
+        except MykoError as ex:
+            _LOGGER.warning("Failed to update %s: %s", self._name, ex)
+            return
+        if not state:
+            return
+        self.apply_state(state)
+
+    def apply_state(self, state) -> None:
+        """Take over a state fetched by update, a command or MykoPoller."""
+        self._updated = True
+        self._stale = False
+        self._state = state.get("power", self._state)
 
         if self._debug:
             self._debugInfo = self._myko.getDebugInfo(self._childId)
 
-        # ColorMode.ONOFF is the only color mode that doesn't support brightness
-        if ColorMode.ONOFF not in self._supported_color_modes:
-            self._brightness = _brightness_to_hass(
-                state["brightness"]
-            )
+        capabilities = self._capabilities
+        if capabilities.has_brightness and "brightness" in state:
+            self._brightness = _brightness_to_hass(state["brightness"])
 
-        if any(mode in COLOR_MODES_COLOR for mode in self._supported_color_modes):
+        if capabilities.has_rgb and "color-rgb" in state:
             rgb = state["color-rgb"]["color-rgb"]
             self._rgbColor = (rgb["r"], rgb["g"], rgb["b"])
 
-        if (
-            any(mode in COLOR_MODES_COLOR for mode in self._supported_color_modes)
-            or ColorMode.COLOR_TEMP in self._supported_color_modes
-        ):
-            self._colorMode = state["color-mode"]
+        if capabilities.has_color_mode:
+            self._colorMode = state.get("color-mode")
+        if capabilities.has_color_temp and "color-temperature" in state:
             self._color_temp = state["color-temperature"]
-            if (
-                self._temperature_suffix is not None
-                and isinstance(self._color_temp, str)
-                and self._color_temp.endswith(self._temperature_suffix)
-            ):
-                self._color_temp = self._color_temp[: -len(self._temperature_suffix)]
+
+
+class MykoGroupLight(LightEntity):
+    """A Myko home or room, switched as one light.
+
+    The state is aggregated from the cached states of the member lights, so
+    the group never makes requests of its own; MykoPoller aggregates again
+    when a member changes. Commands fan out to all members at once through
+    their executor.
+    """
+
+    def __init__(self, myko, friendlyname, groupId, members) -> None:
+        self._myko = myko
+        self._name = friendlyname
+        self._groupId = groupId
+        self._members = members
+        self._state = None
+        self._brightness = None
+        if all(member._capabilities.has_brightness for member in members):
+            self._supported_color_modes = frozenset([ColorMode.BRIGHTNESS])
+        else:
+            self._supported_color_modes = frozenset([ColorMode.ONOFF])
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def unique_id(self) -> str:
+        return self._groupId
+
+    @property
+    def member_ids(self) -> list[str]:
+        return [member.unique_id for member in self._members]
+
+    @property
+    def should_poll(self):
+        """MykoPoller pushes changes, see there."""
+        return False
+
+    @property
+    def available(self) -> bool:
+        return any(member.available for member in self._members)
+
+    @property
+    def color_mode(self) -> ColorMode:
+        return next(iter(self._supported_color_modes))
+
+    @property
+    def supported_color_modes(self) -> frozenset[ColorMode]:
+        return self._supported_color_modes
+
+    @property
+    def supported_features(self) -> LightEntityFeature:
+        if any(member.supported_features for member in self._members):
+            return LightEntityFeature.TRANSITION
+        return LightEntityFeature(0)
+
+    @property
+    def brightness(self) -> int or None:
+        return self._brightness
+
+    @property
+    def is_on(self) -> bool | None:
+        if self._state is None:
+            return None
+        return self._state == "on"
+
+    @property
+    def extra_state_attributes(self):
+        return {"members": self.member_ids}
+
+    def aggregate(self) -> None:
+        """Take over the member states the last poll or command cached."""
+        states = [self._myko.get_cached_state(member.unique_id) for member in self._members]
+        states = [state for state in states if state]
+        if not states:
+            return
+        on = [state for state in states if state.get("power") == "on"]
+        self._state = "on" if on else "off"
+        brightness = [
+            _brightness_to_hass(state["brightness"]) for state in on if "brightness" in state
+        ]
+        self._brightness = sum(brightness) // len(brightness) if brightness else None
+
+    async def async_update(self) -> None:
+        """Aggregate the member states on request, no request is made."""
+        self.aggregate()
+
+    async def _async_fan_out(self, action, *args, **kwargs) -> None:
+        # Offline members are left out instead of failing the whole group.
+        members = [member for member in self._members if member.available]
+        results = await asyncio.gather(
+            *(getattr(member, action)(*args, **kwargs) for member in members),
+            return_exceptions=True,
+        )
+        self.aggregate()
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise HomeAssistantError(
+                f"{len(errors)} of {len(members)} lights in {self._name} failed: {errors[0]}"
+            )
+
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        await self._async_fan_out("async_turn_on", **kwargs)
+
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        await self._async_fan_out("async_turn_off", **kwargs)
+
+    async def async_send_command(self, functionClass, value) -> None:
+        await self._async_fan_out("async_send_command", functionClass, value)
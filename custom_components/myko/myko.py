@@ -1,4 +1,4 @@
-import requests
+import functools
 import json
 import re
 import calendar
@@ -6,8 +6,21 @@ import datetime
 import hashlib
 import base64
 import os
-import asyncio
 import logging
+import threading
+import time
+
+from .breaker import CircuitBreaker
+from .exceptions import MykoConnectionError, MykoError
+from .hedging import Hedger
+from .profiling import PhaseTimer, timed
+from .transport import (
+    CONNECT_TIMEOUT,
+    READ_TIMEOUT,
+    Deadline,
+    create_transport,
+    json_decoder,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,6 +30,27 @@ API_HOST = 'api2.sxz2xlhh.afero.net'
 AUTH_HOST = 'accounts.mykoapp.com'
 SEMANTICS_HOST = 'semantics2.sxz2xlhh.afero.net'
 REALM_ID = 'kfi'
+# poll_changes re-reads every value this often, see there.
+FULL_POLL_EVERY = 10
+# Seconds the metadevice catalog (descriptions, names, rooms) is reused.
+CATALOG_TTL = 900
+# Exposed as diagnostic sensors, see getDiagnostics.
+DIAGNOSTIC_FUNCTIONS = frozenset(["wifi-rssi", "wifi-ssid", "error-flag", "ble-mac-address"])
+# What a scene snapshot captures. Deliberately an allow list, restoring a
+# scene must never write settings such as lock-control or lock-pin.
+SCENE_FUNCTIONS = frozenset(
+    [
+        "power",
+        "brightness",
+        "color-mode",
+        "color-rgb",
+        "color-sequence",
+        "color-temperature",
+        "fan-speed",
+        "fan-reverse",
+        "toggle",
+    ]
+)
 
 class Myko:
 
@@ -28,12 +62,129 @@ class Myko:
     _last_token_time = None
     # Token lasts 120 seconds
     _token_duration = 118 * 1000
-
-    def __init__(self, username, password):
+    # Per request timeouts and the overall deadline of one operation, e.g.
+    # token refresh plus the actual request. Login has three round trips.
+    _connect_timeout = CONNECT_TIMEOUT
+    _read_timeout = READ_TIMEOUT
+    _operation_timeout = 30
+    _login_timeout = 45
+
+    def __init__(
+        self,
+        username,
+        password,
+        http2=False,
+        api_url=None,
+        auth_url=None,
+        breaker=None,
+        operation_timeout=None,
+        transport=None,
+        rate_limiter=None,
+        hedge=False,
+        decoder=None,
+    ):
         self._username = username
         self._password = password
-        self._refresh_token = self.getRefreshCode()
-        self._accountId = self.getAccountId()
+        # Overridable so the client can be pointed at tools/afero_simulator.py
+        self._api_url = api_url or "https://" + API_HOST
+        self._auth_url = auth_url or "https://" + AUTH_HOST
+        # Accounts may share one transport (connection pool) and rate limiter,
+        # tokens, breaker and caches always stay per account.
+        self._transport = transport or create_transport(http2=http2)
+        self._rate_limiter = rate_limiter
+        # Duplicates slow state GETs and PUTs, see Hedger.
+        self._hedger = Hedger() if hedge else None
+        # Decodes response bodies, a function or a json_decoder name.
+        self._decoder = decoder if callable(decoder) else json_decoder(decoder)
+        self._breaker = breaker or CircuitBreaker()
+        # Last known state per metadevice, as returned by get_state/set_state
+        # and poll_changes. Polls and commands run in different threads of
+        # the account executor, _states_lock guards it and the command marks.
+        self._states = {}
+        self._states_lock = threading.Lock()
+        # Commands finished so far, and that count after the last command
+        # per metadevice, see command_mark.
+        self._commands = 0
+        self._command_marks = {}
+        # poll_changes high-water marks: lastUpdateTime per metadevice and
+        # (functionClass, functionInstance).
+        self._value_times = {}
+        self._polls = 0
+        # DIAGNOSTIC_FUNCTIONS values per metadevice, by (functionClass, functionInstance).
+        self._diagnostics = {}
+        # Reported by the "available" function, unknown devices count as online.
+        self._device_available = {}
+        self._catalog = None
+        self._catalog_time = 0
+        self._catalog_lock = threading.Lock()
+        if operation_timeout is not None:
+            self._operation_timeout = operation_timeout
+            self._login_timeout = max(self._login_timeout, operation_timeout)
+        # Startup phases, the light platform adds its own.
+        self.startup = PhaseTimer()
+        with self.startup.phase("login"):
+            self._refresh_token = self.getRefreshCode()
+        with self.startup.phase("account"):
+            self._accountId = self.getAccountId()
+
+    @property
+    def available(self):
+        """False while the circuit breaker is failing calls fast."""
+        return self._breaker.available
+
+    def add_availability_listener(self, listener):
+        return self._breaker.add_listener(listener)
+
+    def _deadline(self, deadline=None):
+        return deadline or Deadline(self._operation_timeout)
+
+    @timed
+    def _request(self, method, url, deadline=None, hedge=False, **kwargs):
+        deadline = self._deadline(deadline)
+        # The breaker goes first, while it is open calls fail at once instead
+        # of waiting for a slot of the rate limiter the accounts share.
+        self._breaker.before_call()
+        try:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(deadline)
+            timeout = deadline.timeout(self._connect_timeout, self._read_timeout)
+        except BaseException:
+            # Never sent, but a half open probe must not stay claimed.
+            self._breaker.release()
+            raise
+        send = functools.partial(self._transport.request, method, url, timeout=timeout, **kwargs)
+        try:
+            if hedge and self._hedger is not None:
+                r = self._hedger.call(send, functools.partial(self._send_duplicate, send, deadline))
+            else:
+                r = send()
+        except MykoConnectionError:
+            self._breaker.record_failure()
+            raise
+        except BaseException:
+            self._breaker.release()
+            raise
+        if r.status_code >= 500:
+            self._breaker.record_failure()
+        else:
+            self._breaker.record_success()
+        r.decoder = self._decoder
+        return r
+
+    def _send_duplicate(self, send, deadline):
+        # A hedge is a real extra request, it counts against the rate limit.
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(deadline)
+        return send()
+
+    def hedge_stats(self):
+        """Hedging counters, None unless hedging is enabled."""
+        return self._hedger.stats() if self._hedger is not None else None
+
+    def shutdown(self):
+        """Stop the hedging threads. The transport may be shared, its owner closes it."""
+        if self._hedger is not None:
+            self._hedger.shutdown()
 
     def getUTCTime(self):
         date = datetime.datetime.utcnow()
@@ -48,9 +199,12 @@ class Myko:
         code_challenge = code_challenge.replace("=", "")
         return code_challenge, code_verifier
 
-    def getRefreshCode(self):
+    @timed
+    def getRefreshCode(self, deadline=None):
+
+        deadline = deadline or Deadline(self._login_timeout)
 
-        URL = "https://" + AUTH_HOST + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/auth"
+        URL = self._auth_url + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/auth"
 
         [code_challenge, code_verifier] = self.getCodeVerifierAndChallenge()
 
@@ -65,8 +219,7 @@ class Myko:
         }
 
         # sending get request and saving the response as response object
-        r = requests.get(url=URL, params=PARAMS)
-        r.close()
+        r = self._request("GET", URL, deadline=deadline, params=PARAMS)
         headers = r.headers
 
         session_code = re.search("session_code=(.+?)&", r.text).group(1)
@@ -74,7 +227,7 @@ class Myko:
         tab_id = re.search("tab_id=(.+?)&", r.text).group(1)
 
         auth_url = (
-            "https://" + AUTH_HOST + "/auth/realms/" + REALM_ID + "/login-actions/authenticate?session_code="
+            self._auth_url + "/auth/realms/" + REALM_ID + "/login-actions/authenticate?session_code="
             + session_code
             + "&execution="
             + execution
@@ -94,14 +247,15 @@ class Myko:
         }
 
         headers = {}
-        r = requests.post(
+        r = self._request(
+            "POST",
             auth_url,
+            deadline=deadline,
             data=auth_data,
             headers=auth_header,
-            cookies=r.cookies.get_dict(),
+            cookies=r.cookies,
             allow_redirects=False,
         )
-        r.close()
         # print("first headers")
         # print(r.headers)
         location = r.headers.get("location")
@@ -109,7 +263,7 @@ class Myko:
         session_state = re.search("session_state=(.+?)&code", location).group(1)
         code = re.search("&code=(.+?)$", location).group(1)
 
-        auth_url = "https://" + AUTH_HOST + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/token"
+        auth_url = self._auth_url + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/token"
 
         auth_header = {
             "Content-Type": "application/x-www-form-urlencoded",
@@ -126,13 +280,13 @@ class Myko:
         }
 
         headers = {}
-        r = requests.post(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("POST", auth_url, deadline=deadline, data=auth_data, headers=auth_header)
         refresh_token = r.json().get("refresh_token")
         # print(refresh_token)
         return refresh_token
 
-    def getAuthTokenFromRefreshToken(self):
+    @timed
+    def getAuthTokenFromRefreshToken(self, deadline=None):
 
         utcTime = self.getUTCTime()
 
@@ -143,7 +297,7 @@ class Myko:
             return self._last_token
 
         # _LOGGER.debug("Get New Token")
-        auth_url = "https://" + AUTH_HOST + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/token"
+        auth_url = self._auth_url + "/auth/realms/" + REALM_ID + "/protocol/openid-connect/token"
 
         auth_header = {
             "Content-Type": "application/x-www-form-urlencoded",
@@ -159,18 +313,19 @@ class Myko:
         }
 
         headers = {}
-        r = requests.post(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("POST", auth_url, deadline=deadline, data=auth_data, headers=auth_header)
         token = r.json().get("id_token")
         self._last_token = token
         self._last_token_time = utcTime
 
         return token
 
-    def getAccountId(self):
+    @timed
+    def getAccountId(self, deadline=None):
 
-        token = self.getAuthTokenFromRefreshToken()
-        auth_url = "https://" + API_HOST + "/v1/users/me"
+        deadline = self._deadline(deadline)
+        token = self.getAuthTokenFromRefreshToken(deadline)
+        auth_url = self._api_url + "/v1/users/me"
 
         auth_header = {
             "user-agent": "Dart/2.15 (dart:io)",
@@ -179,16 +334,17 @@ class Myko:
             "authorization": "Bearer " + token,
         }
 
-        auth_data = {}
         headers = {}
-        r = requests.get(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("GET", auth_url, deadline=deadline, headers=auth_header)
         accountId = r.json().get("accountAccess")[0].get("account").get("accountId")
         return accountId
 
-    def getMetadeviceInfo(self):
+    @timed
+    def getMetadeviceInfo(self, deadline=None, state=True):
+        """Request the metadevice list, with the live state of each unless ``state`` is False."""
 
-        token = self.getAuthTokenFromRefreshToken()
+        deadline = self._deadline(deadline)
+        token = self.getAuthTokenFromRefreshToken(deadline)
 
         _LOGGER.debug("token " + token)
         auth_header = {
@@ -200,25 +356,44 @@ class Myko:
 
         _LOGGER.debug("token " + self._accountId)
         auth_url = (
-            "https://" + API_HOST + "/v1/accounts/"
+            self._api_url + "/v1/accounts/"
             + self._accountId
-            + "/metadevices?expansions=state"
+            + "/metadevices"
         )
+        if state:
+            auth_url += "?expansions=state"
 
-        auth_data = {}
         headers = {}
-        r = requests.get(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("GET", auth_url, deadline=deadline, headers=auth_header)
 
         return r
 
+    def getCatalog(self, deadline=None, refresh=False):
+        """Return the metadevice list without state, cached for ``CATALOG_TTL`` seconds.
+
+        Names, descriptions and the home/room hierarchy rarely change, so
+        lookups share this instead of fetching the live state they never read.
+        """
+        with self._catalog_lock:
+            if (
+                refresh
+                or self._catalog is None
+                or time.monotonic() - self._catalog_time > CATALOG_TTL
+            ):
+                r = self.getMetadeviceInfo(deadline, state=False)
+                if not r.ok:
+                    raise MykoError(f"Metadevice list failed with {r.status_code}")
+                self._catalog = r.json()
+                self._catalog_time = time.monotonic()
+            return self._catalog
+
     def getChildrenFromRoom(self, roomName):
 
-        response = self.getMetadeviceInfo()
+        catalog = self.getCatalog()
 
         children = None
 
-        for lis in response.json():
+        for lis in catalog:
             for key, val in lis.items():
                 if key == "friendlyName" and val == roomName:
                     if lis.get("typeId") == "metadevice.room":
@@ -230,9 +405,10 @@ class Myko:
         _LOGGER.debug("No children found ")
         return children
 
+    @timed
     def getChildInfoById(self, childId):
 
-        response = self.getMetadeviceInfo()
+        catalog = self.getCatalog()
 
         child = None
         model = None
@@ -240,7 +416,7 @@ class Myko:
         deviceClass = None
         friendlyName = None
 
-        for lis in response.json():
+        for lis in catalog:
             for key, val in lis.items():
                 if (
                     key == "id"
@@ -280,9 +456,10 @@ class Myko:
         # _LOGGER.debug("No model found ")
         return child, model, deviceId, deviceClass, friendlyName
 
+    @timed
     def getChildId(self, deviceName):
 
-        response = self.getMetadeviceInfo()
+        catalog = self.getCatalog()
 
         child = None
         model = None
@@ -293,7 +470,7 @@ class Myko:
         # _LOGGER.debug(json.dumps(response.json(), indent=4, sort_keys=True))
         # _LOGGER.debug("############ End Dump #########")
 
-        for lis in response.json():
+        for lis in catalog:
             for key, val in lis.items():
                 if (
                     key == "friendlyName"
@@ -332,10 +509,11 @@ class Myko:
         # _LOGGER.debug("No model found ")
         return child, model, deviceId, deviceClass
 
+    @timed
     def discoverDeviceIds(self):
-        response = self.getMetadeviceInfo()
+        catalog = self.getCatalog()
 
-        for lis in response.json():
+        for lis in catalog:
             if lis.get("typeId") == "metadevice.device":
                 child = lis.get("id")
                 deviceId = lis.get("deviceId")
@@ -347,23 +525,37 @@ class Myko:
                 functions = lis.get("description", {}).get("functions", [])
                 yield child, model, deviceId, deviceClass, friendlyName, functions
 
+    @timed
+    def discoverGroups(self):
+        """Yield id, typeId, friendlyName and children of every home and room."""
+        catalog = self.getCatalog()
+
+        for lis in catalog:
+            if lis.get("typeId") in ("metadevice.home", "metadevice.room"):
+                yield lis.get("id"), lis.get("typeId"), lis.get("friendlyName"), lis.get("children", [])
+
     def getFunctions(self, id, functionClass=None):
-        response = self.getMetadeviceInfo()
+        """Return the functions of id, all or only those of functionClass."""
+        catalog = self.getCatalog()
 
-        for lis in response.json():
+        for lis in catalog:
             if lis.get("id") == id:
                 functions = lis.get("description", {}).get("functions", [])
-                if functionClass is None:
-                    return functions
-                for function in functions:
-                    if function.get("functionClass") == functionClass:
-                        yield function
+                return [
+                    function
+                    for function in functions
+                    if functionClass is None
+                    or function.get("functionClass") == functionClass
+                ]
+        return []
 
-    def get_state(self, child):
+    @timed
+    def get_state(self, child, deadline=None):
 
         state = None
 
-        token = self.getAuthTokenFromRefreshToken()
+        deadline = self._deadline(deadline)
+        token = self.getAuthTokenFromRefreshToken(deadline)
         if token is None:
             _LOGGER.debug("No token retrieved")
             return None
@@ -375,34 +567,190 @@ class Myko:
             "authorization": "Bearer " + token,
         }
         auth_url = (
-            "https://" + API_HOST + "/v1/accounts/"
+            self._api_url + "/v1/accounts/"
             + self._accountId
             + "/metadevices/"
             + child
             + "/state"
         )
-        auth_data = {}
         headers = {}
 
-        r = requests.get(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("GET", auth_url, deadline=deadline, hedge=True, headers=auth_header)
 
-        state = self._state_response_to_state_dict(r)
+        state = self._state_response_to_state_dict(r, child)
+        if state:
+            with self._states_lock:
+                self._states[child] = state
         return state
 
+    def command_mark(self):
+        """Return a mark to pass to ``commanded_since``, take it before fetching state."""
+        with self._states_lock:
+            return self._commands
+
+    def commanded_since(self, child, mark):
+        """True if a command for child finished after ``command_mark`` returned mark."""
+        with self._states_lock:
+            return self._command_marks.get(child, 0) > mark
+
+    @timed
+    def poll_changes(self, deadline=None, mark=None):
+        """Fetch the state of every device and return ``{child: state}`` for those that changed.
+
+        Only values with a newer ``lastUpdateTime`` than in the last call are
+        applied. The device ``version`` and ``updatedTimestampMs`` are no use
+        for this, the cloud leaves them alone when a value changes. Every
+        ``FULL_POLL_EVERY`` calls all values are re-read, in case the cloud
+        changed a value without its update time.
+
+        Devices that had a command since ``mark`` (see ``command_mark``,
+        default when this call started) are left out, the command result is
+        newer than what the poll fetched. The next poll picks them up.
+        """
+        if mark is None:
+            mark = self.command_mark()
+        response = self.getMetadeviceInfo(deadline)
+        if not response.ok:
+            return {}
+        self._polls += 1
+        if self._polls % FULL_POLL_EVERY == 0:
+            self._value_times = {}
+
+        changed = {}
+        with self._states_lock:
+            for lis in response.json():
+                if lis.get("typeId") != "metadevice.device":
+                    continue
+                child = lis.get("id")
+                if self._command_marks.get(child, 0) > mark:
+                    continue
+                times = self._value_times.setdefault(child, {})
+                previous = self._states.get(child, {})
+                state = dict(previous)
+                availability_changed = False
+                diagnostics_changed = False
+                for value in lis.get("state", {}).get("values", []):
+                    key = (value.get("functionClass"), value.get("functionInstance"))
+                    updated = value.get("lastUpdateTime")
+                    if updated is not None and times.get(key) == updated:
+                        continue
+                    times[key] = updated
+                    if key[0] in DIAGNOSTIC_FUNCTIONS:
+                        diagnostics = self._diagnostics.setdefault(child, {})
+                        if diagnostics.get(key) != value.get("value"):
+                            diagnostics[key] = value.get("value")
+                            diagnostics_changed = True
+                    if key[0] == "available":
+                        availability_changed = self._set_device_available(
+                            child, value.get("value")
+                        )
+                    elif value.get("value"):
+                        state[key[0]] = value["value"]
+                        if key[1] is not None:
+                            # Per instance as well, e.g. fade-on and fade-off.
+                            state[key] = value["value"]
+                if state and state != previous:
+                    self._states[child] = state
+                    changed[child] = state
+                elif availability_changed or diagnostics_changed:
+                    changed[child] = previous
+        return changed
+
+    @timed
+    def snapshot(self, children=None, deadline=None):
+        """Capture the scene values of children, or all devices, in one request.
+
+        Returns ``{child: {(functionClass, functionInstance): value}}`` with the
+        function classes in ``SCENE_FUNCTIONS``, ready for set_state.
+        """
+        response = self.getMetadeviceInfo(deadline)
+        if not response.ok:
+            raise MykoError(f"Metadevice list failed with {response.status_code}")
+        wanted = set(children) if children is not None else None
+        snapshot = {}
+        for lis in response.json():
+            child = lis.get("id")
+            if lis.get("typeId") != "metadevice.device":
+                continue
+            if wanted is not None and child not in wanted:
+                continue
+            snapshot[child] = {
+                (value.get("functionClass"), value.get("functionInstance")): value["value"]
+                for value in lis.get("state", {}).get("values", [])
+                if value.get("functionClass") in SCENE_FUNCTIONS
+                and value.get("value") is not None
+            }
+        return snapshot
+
+    @staticmethod
+    def scene_diff(scene, current):
+        """Return ``{child: values}`` with only the values of scene that differ from current."""
+        diff = {}
+        for child, values in scene.items():
+            now = current.get(child, {})
+            changed = {key: value for key, value in values.items() if now.get(key) != value}
+            if changed:
+                diff[child] = changed
+        return diff
+
+    def _set_device_available(self, child, value):
+        """Record the "available" value of child, True if that changed it."""
+        available = value is not False
+        changed = self._device_available.get(child, True) != available
+        self._device_available[child] = available
+        if changed:
+            _LOGGER.info("Myko device %s is %s", child, "online" if available else "offline")
+        return changed
+
+    def device_available(self, child):
+        """False while the cloud reports child offline (unplugged, off Wi-Fi)."""
+        return self._device_available.get(child, True)
+
+    @timed
+    def getDiagnostics(self, deadline=None):
+        """Fetch and return ``{child: {(functionClass, functionInstance): value}}``.
+
+        Only needed once to learn which devices report what, poll_changes
+        keeps the values current, see get_cached_diagnostics.
+        """
+        response = self.getMetadeviceInfo(deadline)
+        if not response.ok:
+            raise MykoError(f"Metadevice list failed with {response.status_code}")
+        for lis in response.json():
+            if lis.get("typeId") != "metadevice.device":
+                continue
+            diagnostics = self._diagnostics.setdefault(lis.get("id"), {})
+            for value in lis.get("state", {}).get("values", []):
+                if value.get("functionClass") in DIAGNOSTIC_FUNCTIONS:
+                    key = (value.get("functionClass"), value.get("functionInstance"))
+                    diagnostics[key] = value.get("value")
+        return {child: dict(values) for child, values in self._diagnostics.items()}
+
+    def get_cached_diagnostics(self, child):
+        """Return the last DIAGNOSTIC_FUNCTIONS values seen for child."""
+        return self._diagnostics.get(child, {})
+
+    def get_cached_state(self, child):
+        """Return the last state seen for child without making a request."""
+        with self._states_lock:
+            return self._states.get(child)
+
+    @timed
     def getDebugInfo(self, child):
 
         state = None
 
-        r = self.getMetadeviceInfo()
+        deadline = self._deadline()
+        r = self.getMetadeviceInfo(deadline)
 
         _LOGGER.debug("############ Dumping all info 1 0f 2 #########")
-        _LOGGER.debug(json.dumps(r.json(), indent=4, sort_keys=True))
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(json.dumps(r.json(), indent=4, sort_keys=True))
         _LOGGER.debug("############ End Dump #########")
 
-        token = self.getAuthTokenFromRefreshToken()
+        token = self.getAuthTokenFromRefreshToken(deadline)
         auth_url = (
-            "https://" + API_HOST + "/v1/accounts/"
+            self._api_url + "/v1/accounts/"
             + self._accountId
             + "/metadevices/"
             + child
@@ -415,18 +763,18 @@ class Myko:
             "authorization": "Bearer " + token,
         }
 
-        auth_data = {}
-
-        r = requests.get(auth_url, data=auth_data, headers=auth_header)
-        r.close()
+        r = self._request("GET", auth_url, deadline=deadline, headers=auth_header)
         _LOGGER.debug("############ Dumping all info 2 0f 2 #########")
-        _LOGGER.debug(json.dumps(r.json(), indent=4, sort_keys=True))
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(json.dumps(r.json(), indent=4, sort_keys=True))
         _LOGGER.debug("############ End Dump #########")
         return r.json()
 
-    def set_state(self, child, state_values):
+    @timed
+    def set_state(self, child, state_values, deadline=None):
         """Updates state and returns new state dict."""
-        token = self.getAuthTokenFromRefreshToken()
+        deadline = self._deadline(deadline)
+        token = self.getAuthTokenFromRefreshToken(deadline)
 
         auth_data = {}
         headers = {}
@@ -434,13 +782,21 @@ class Myko:
         utc_time = self.getUTCTime()
 
 
+        # Keys are a functionClass, or (functionClass, functionInstance).
         values = []
-        for state_name in state_values:
-            values.append({
-                "functionClass": state_name,
+        for state_name, value in state_values.items():
+            if isinstance(state_name, tuple):
+                functionClass, functionInstance = state_name
+            else:
+                functionClass, functionInstance = state_name, None
+            item = {
+                "functionClass": functionClass,
                 "lastUpdateTime": utc_time,
-                "value": state_values[state_name],
-            })
+                "value": value,
+            }
+            if functionInstance is not None:
+                item["functionInstance"] = functionInstance
+            values.append(item)
 
 
         payload = {
@@ -457,22 +813,35 @@ class Myko:
         }
 
         auth_url = (
-            "https://" + API_HOST + "/v1/accounts/"
+            self._api_url + "/v1/accounts/"
             + self._accountId
             + "/metadevices/"
             + child
             + "/state"
         )
-        r = requests.put(auth_url, json=payload, headers=auth_header)
-        r.close()
-
-
-        state = self._state_response_to_state_dict(r)
+        # The payload carries absolute values, sending it twice is harmless.
+        try:
+            r = self._request(
+                "PUT", auth_url, deadline=deadline, hedge=True, json=payload, headers=auth_header
+            )
+        finally:
+            # Even a failed PUT may have reached the device, polls that
+            # started before it do not know either way.
+            with self._states_lock:
+                self._commands += 1
+                self._command_marks[child] = self._commands
+
+
+        state = self._state_response_to_state_dict(r, child)
+        if state:
+            with self._states_lock:
+                self._states[child] = state
         return state
 
-    async def getConclave(self):
+    async def getConclave(self, deadline=None):
 
-        token = self.getAuthTokenFromRefreshToken()
+        deadline = self._deadline(deadline)
+        token = self.getAuthTokenFromRefreshToken(deadline)
 
         auth_data = {}
         headers = {}
@@ -488,22 +857,27 @@ class Myko:
         }
 
         auth_url = (
-            "https://" + API_HOST + "/v1/accounts/" + self._accountId + "/conclaveAccess"
+            self._api_url + "/v1/accounts/" + self._accountId + "/conclaveAccess"
         )
-        r = requests.post(auth_url, json=payload, headers=auth_header)
-        r.close()
+        r = self._request("POST", auth_url, deadline=deadline, json=payload, headers=auth_header)
         # print(json.dumps(r.json(), indent=4, sort_keys=True))
-        host = r.json().get("conclave").get("host")
-        port = r.json().get("conclave").get("port")
-        token = r.json().get("tokens")[0].get("token")
-        expiresTimestamp = r.json().get("tokens")[0].get("expiresTimestamp")
-
-    def _state_response_to_state_dict(self, r):
+        conclave = r.json()
+        host = conclave.get("conclave").get("host")
+        port = conclave.get("conclave").get("port")
+        token = conclave.get("tokens")[0].get("token")
+        expiresTimestamp = conclave.get("tokens")[0].get("expiresTimestamp")
+
+    @timed
+    def _state_response_to_state_dict(self, r, child=None):
         state = {}
         if r.ok:
             for lis in r.json().get("values"):
                 for key, val in lis.items():
                     value = lis.get("value")
+                    if key == "functionClass" and val == "available" and child is not None:
+                        self._set_device_available(child, value)
                     if key == "functionClass" and val != "available" and value:
                         state[val] = value
+                        if lis.get("functionInstance") is not None:
+                            state[(val, lis["functionInstance"])] = value
         return state
@@ -0,0 +1,180 @@
+"""Timing spans and on-demand profiling of Myko poll cycles."""
+from __future__ import annotations
+
+import contextlib
+import functools
+import inspect
+import io
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_LINES = 40
+TRACEMALLOC_LINES = 20
+
+
+class Spans:
+    """Call count and wall time per ``Myko`` method.
+
+    Disabled by default; while disabled a timed call costs one attribute
+    check, so it can be switched on and off at runtime.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            count, total, longest = self._stats.get(name, (0, 0.0, 0.0))
+            self._stats[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def report(self):
+        """Return ``{name: {calls, total, mean, max}}``, slowest total first."""
+        with self._lock:
+            stats = sorted(self._stats.items(), key=lambda item: -item[1][1])
+        return {
+            name: {
+                "calls": count,
+                "total": round(total, 4),
+                "mean": round(total / count, 4),
+                "max": round(longest, 4),
+            }
+            for name, (count, total, longest) in stats
+        }
+
+    def format(self):
+        lines = [f"{'span':40} {'calls':>7} {'total s':>9} {'mean s':>9} {'max s':>9}"]
+        for name, stat in self.report().items():
+            lines.append(
+                f"{name:40} {stat['calls']:7} {stat['total']:9.4f} {stat['mean']:9.4f} {stat['max']:9.4f}"
+            )
+        return "\n".join(lines)
+
+
+SPANS = Spans()
+
+
+class PhaseTimer:
+    """Wall time of named startup phases, in the order they ran."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(
+                self.timings.get(name, 0) + time.perf_counter() - start, 4
+            )
+
+    def format(self):
+        return ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.timings.items())
+
+
+def timed(fn):
+    """Record the calls of ``fn`` in ``SPANS`` while spans are enabled.
+
+    For generators only the time spent producing items is counted, not the
+    time the caller spends between them.
+    """
+    name = fn.__qualname__
+
+    if inspect.isgeneratorfunction(fn):
+
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            if not SPANS.enabled:
+                yield from fn(*args, **kwargs)
+                return
+            elapsed = 0.0
+            start = time.perf_counter()
+            iterator = fn(*args, **kwargs)
+            try:
+                while True:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    elapsed += time.perf_counter() - start
+                    yield item
+                    start = time.perf_counter()
+            finally:
+                elapsed += time.perf_counter() - start
+                SPANS.record(name, elapsed)
+
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not SPANS.enabled:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            SPANS.record(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def profile_polls(polls, cycles, path, memory=True):
+    """Run every poll in ``polls`` ``cycles`` times and write a report to ``path``.
+
+    The report holds the wall time per cycle, the ``Myko`` spans, the
+    cProfile hot spots by cumulative time and, with ``memory``, the lines
+    that allocated the most memory.
+    """
+    # Only needed here, kept out of the import of the integration.
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    spans_enabled = SPANS.enabled
+    SPANS.reset()
+    SPANS.enabled = True
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    durations = []
+    try:
+        for _ in range(cycles):
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                for poll in polls:
+                    poll()
+            finally:
+                profiler.disable()
+            durations.append(time.perf_counter() - start)
+        snapshot = tracemalloc.take_snapshot() if memory else None
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if tracing:
+            tracemalloc.stop()
+        SPANS.enabled = spans_enabled
+
+    out = io.StringIO()
+    out.write(f"Myko profile, {len(polls)} polls x {cycles} cycles\n")
+    out.write("cycle seconds: " + ", ".join(f"{d:.3f}" for d in durations) + "\n\n")
+    out.write(SPANS.format() + "\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    if snapshot is not None:
+        out.write(f"tracemalloc peak: {peak / 1024:.1f} KiB\n")
+        for stat in snapshot.statistics("lineno")[:TRACEMALLOC_LINES]:
+            out.write(f"{stat}\n")
+    with open(path, "w") as f:
+        f.write(out.getvalue())
+    _LOGGER.info("Myko profile written to %s", path)
+    return path
@@ -0,0 +1,39 @@
+"""Request rate limiter shared by every Myko account."""
+from __future__ import annotations
+
+import threading
+import time
+
+from .exceptions import MykoTimeout
+
+DEFAULT_RATE = 10
+DEFAULT_BURST = 20
+
+
+class RateLimiter:
+    """Spread requests to at most ``rate`` per second, allowing ``burst``.
+
+    Callers reserve a slot under the lock and sleep outside of it, so slots
+    are handed out first come, first served and a busy account cannot starve
+    the others. A caller whose slot would land after its deadline fails with
+    ``MykoTimeout`` without reserving anything.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._interval = 1 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        with self._lock:
+            now = time.monotonic()
+            next_slot = max(self._next, now)
+            wait = max(next_slot - (self.burst - 1) * self._interval - now, 0)
+            if deadline is not None and wait > deadline.remaining():
+                raise MykoTimeout(f"Rate limit wait of {wait:.1f}s exceeds the deadline")
+            self._next = next_slot + self._interval
+        if wait:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,133 @@
+"""Diagnostic sensors for Myko devices, loaded by the light platform."""
+from __future__ import annotations
+
+import logging
+
+from .exceptions import MykoError
+from .light import DOMAIN
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
+from homeassistant.const import SIGNAL_STRENGTH_DECIBELS_MILLIWATT, EntityCategory
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import PlatformNotReady
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+
+_LOGGER = logging.getLogger(__name__)
+
+# functionClass: (name suffix, device class, unit, state class)
+SENSOR_TYPES = {
+    "wifi-rssi": (
+        "Wi-Fi signal",
+        SensorDeviceClass.SIGNAL_STRENGTH,
+        SIGNAL_STRENGTH_DECIBELS_MILLIWATT,
+        SensorStateClass.MEASUREMENT,
+    ),
+    "wifi-ssid": ("Wi-Fi network", None, None, None),
+    "ble-mac-address": ("Bluetooth MAC", None, None, None),
+    "error-flag": ("Error", SensorDeviceClass.ENUM, None, None),
+}
+
+ERROR_OPTIONS = ["ok", "error"]
+
+
+def setup_platform(
+    hass: HomeAssistant,
+    config: ConfigType,
+    add_entities: AddEntitiesCallback,
+    discovery_info: DiscoveryInfoType | None = None,
+) -> None:
+    """Set up diagnostic sensors for the accounts the light platform discovered."""
+    if discovery_info is None:
+        return
+    data = hass.data[DOMAIN]
+    accounts = [data["accounts"][username] for username in discovery_info["usernames"]]
+    created = []
+    # Everything is fetched before anything is registered, a retry after
+    # PlatformNotReady must not find some accounts set up already.
+    for account in accounts:
+        myko = account["myko"]
+        try:
+            # One request to learn which device reports what, the account
+            # poller keeps the values current from then on.
+            created.append(create_sensors(myko, myko.getDiagnostics()))
+        except MykoError as ex:
+            raise PlatformNotReady(
+                f"Connection error while connecting to myko: {ex}"
+            ) from ex
+
+    entities = []
+    for account, sensors in zip(accounts, created):
+        account["poller"].add_entities(sensors)
+        # Devices added later get their sensors from the account discovery.
+        account["discovery"].track_entities(
+            create_sensors, add_entities, {sensor.childId for sensor in sensors}
+        )
+        entities.extend(sensors)
+    add_entities(entities)
+
+
+def create_sensors(myko, children):
+    """Create a MykoDiagnosticSensor for every diagnostic value of children.
+
+    ``children`` is a ``{childId: values}`` dict as ``getDiagnostics``
+    returns, or childIds whose values the last poll cached.
+    """
+    if not isinstance(children, dict):
+        children = {child: myko.get_cached_diagnostics(child) for child in children}
+    names = {lis.get("id"): lis.get("friendlyName") for lis in myko.getCatalog()}
+    return [
+        MykoDiagnosticSensor(myko, childId, names.get(childId) or childId, key)
+        for childId, values in children.items()
+        for key in values
+    ]
+
+
+class MykoDiagnosticSensor(SensorEntity):
+    """One diagnostic value of a Myko device, pushed by the account poller."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, myko, childId, device_name, key) -> None:
+        self._myko = myko
+        self._childId = childId
+        self._key = key
+        functionClass, functionInstance = key
+        suffix, device_class, unit, state_class = SENSOR_TYPES[functionClass]
+        if functionInstance:
+            suffix = f"{suffix} {functionInstance}"
+        self._attr_name = f"{device_name} {suffix}"
+        self._attr_unique_id = "_".join(
+            part for part in (childId, functionClass, functionInstance) if part
+        )
+        self._attr_device_class = device_class
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+        if device_class == SensorDeviceClass.ENUM:
+            self._attr_options = ERROR_OPTIONS
+        self.apply_state(None)
+
+    @property
+    def childId(self) -> str:
+        return self._childId
+
+    @property
+    def should_poll(self):
+        """MykoPoller pushes changes, see there."""
+        return False
+
+    @property
+    def available(self) -> bool:
+        return self._myko.available
+
+    def apply_state(self, state) -> None:
+        """Take over the value from the diagnostics the last poll recorded."""
+        value = self._myko.get_cached_diagnostics(self._childId).get(self._key)
+        if self._key[0] == "error-flag":
+            value = None if value is None else ERROR_OPTIONS[bool(value)]
+        elif self._key[0] == "wifi-rssi" and value is not None:
+            value = int(value)
+        self._attr_native_value = value
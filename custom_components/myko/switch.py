@@ -0,0 +1,171 @@
+"""Switches for the outputs of Myko outlets and fans, loaded by the light platform."""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from typing import Any
+
+from .capabilities import encode_timer, timer_ranges
+from .exceptions import MykoError
+from .executor import PRIORITY_COMMAND
+from .light import DOMAIN, _is_light
+from homeassistant.components.switch import SwitchEntity
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError, PlatformNotReady
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+
+_LOGGER = logging.getLogger(__name__)
+
+# On/off functions that switch an output, the timer with the same
+# functionInstance switches the same output.
+SWITCH_FUNCTIONS = ("power", "toggle")
+ON_OFF = {"on", "off"}
+
+
+def setup_platform(
+    hass: HomeAssistant,
+    config: ConfigType,
+    add_entities: AddEntitiesCallback,
+    discovery_info: DiscoveryInfoType | None = None,
+) -> None:
+    """Set up switches for the accounts the light platform discovered."""
+    if discovery_info is None:
+        return
+    data = hass.data[DOMAIN]
+    accounts = [data["accounts"][username] for username in discovery_info["usernames"]]
+    created = []
+    # Everything is fetched before anything is registered, a retry after
+    # PlatformNotReady must not find some accounts set up already.
+    for account in accounts:
+        myko = account["myko"]
+        create = functools.partial(create_switches, executor=account["executor"])
+        try:
+            switches = create(myko, [lis.get("id") for lis in myko.getCatalog()])
+        except MykoError as ex:
+            raise PlatformNotReady(
+                f"Connection error while connecting to myko: {ex}"
+            ) from ex
+        created.append((create, switches))
+
+    entities = []
+    for account, (create, switches) in zip(accounts, created):
+        account["poller"].add_entities(switches)
+        # Devices added later get their switches from the account discovery.
+        account["discovery"].track_entities(
+            create, add_entities, {switch.childId for switch in switches}, register=True
+        )
+        entities.extend(switches)
+    data["entities"].extend(entities)
+    add_entities(entities)
+
+
+def create_switches(myko, children, executor):
+    """Create a MykoSwitch for every output of the devices children that have a timer.
+
+    Lights are left to the light platform. Commands run in ``executor``.
+    """
+    children = set(children)
+    switches = []
+    for lis in myko.getCatalog():
+        if lis.get("typeId") != "metadevice.device" or lis.get("id") not in children:
+            continue
+        device = lis.get("description", {}).get("device", {})
+        functions = lis.get("description", {}).get("functions", [])
+        timers = timer_ranges(functions)
+        if not timers or _is_light(device.get("deviceClass"), functions):
+            continue
+        for function in functions:
+            names = {value.get("name") for value in function.get("values", [])}
+            if function.get("functionClass") in SWITCH_FUNCTIONS and names == ON_OFF:
+                switches.append(
+                    MykoSwitch(
+                        myko, executor, lis.get("id"), lis.get("friendlyName"), function, timers
+                    )
+                )
+    for switch in switches:
+        state = myko.get_cached_state(switch.childId)
+        if state:
+            switch.apply_state(state)
+    return switches
+
+
+class MykoSwitch(SwitchEntity):
+    """One output of a Myko outlet or fan, with the device timer for it."""
+
+    def __init__(self, myko, executor, childId, device_name, function, timers) -> None:
+        self._myko = myko
+        self._executor = executor
+        self._childId = childId
+        self._key = (function.get("functionClass"), function.get("functionInstance"))
+        instance = self._key[1]
+        self._attr_name = f"{device_name} {instance}" if instance else device_name
+        self._attr_unique_id = "_".join(part for part in (childId, *self._key) if part)
+        # The timer of this output, or of the device if it has just one.
+        if instance in timers:
+            self._timers = {instance: timers[instance]}
+        elif len(timers) == 1 and instance is None:
+            self._timers = timers
+        else:
+            self._timers = {}
+        self._attr_is_on = None
+
+    @property
+    def childId(self) -> str:
+        return self._childId
+
+    @property
+    def should_poll(self):
+        """MykoPoller pushes changes, see there."""
+        return False
+
+    @property
+    def available(self) -> bool:
+        return self._myko.available and self._myko.device_available(self._childId)
+
+    @property
+    def has_timer(self) -> bool:
+        return bool(self._timers)
+
+    def apply_state(self, state) -> None:
+        """Take over a state fetched by a command or MykoPoller."""
+        value = state.get(self._key if self._key[1] else self._key[0])
+        if value in ON_OFF:
+            self._attr_is_on = value == "on"
+
+    def set_state(self, state) -> None:
+        if not self._myko.device_available(self._childId):
+            raise HomeAssistantError(f"{self.name} is offline")
+        try:
+            new_state = self._myko.set_state(self._childId, state)
+        except MykoError as ex:
+            raise HomeAssistantError(f"Failed to update {self.name}: {ex}") from ex
+        if new_state:
+            self.apply_state(new_state)
+
+    async def async_set_state(self, state) -> None:
+        """Send state (see Myko.set_state) as one command in the account executor."""
+        await asyncio.wrap_future(
+            self._executor.submit(
+                self.set_state, state, priority=PRIORITY_COMMAND, serial=self._childId
+            )
+        )
+        self.async_write_ha_state()
+
+    async def async_turn_on(self, **kwargs: Any) -> None:
+        await self.async_set_state({self._key: "on"})
+
+    async def async_turn_off(self, **kwargs: Any) -> None:
+        await self.async_set_state({self._key: "off"})
+
+    async def async_send_command(self, functionClass, value) -> None:
+        await self.async_set_state({functionClass: value})
+
+    async def async_set_timer(self, minutes, instance=None) -> None:
+        """Start the device's own countdown for this output, 0 cancels it."""
+        timer = encode_timer(self._timers, minutes, instance)
+        if timer is None:
+            raise HomeAssistantError(f"No device timer {instance or ''} on {self.name}")
+        key, value = timer
+        await self.async_set_state({key: value})
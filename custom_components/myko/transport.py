@@ -0,0 +1,239 @@
+"""HTTP transports for the Myko cloud API.
+
+All of our traffic goes to a handful of hosts, so every request goes through a
+long lived transport instead of opening a fresh connection per call. The
+default transport is a pooled HTTP/1.1 ``requests.Session``. When HTTP/2 is
+enabled and ``httpx`` is installed with the ``h2`` extra, polling, commands and
+token refreshes are multiplexed over a single connection per host.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+
+from .exceptions import MykoConnectionError, MykoTimeout
+
+_LOGGER = logging.getLogger(__name__)
+
+POOL_MAXSIZE = 10
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+
+def json_decoder(name=None):
+    """Return a function decoding JSON ``bytes``.
+
+    ``"orjson"`` or ``"json"`` pick one, ``None`` picks orjson when it is
+    installed and the standard library otherwise. orjson is several times
+    faster on the large metadevice listings.
+    """
+    if name in (None, "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name is not None:
+                raise
+        else:
+            return orjson.loads
+    if name not in (None, "json"):
+        raise ValueError(f"Unknown JSON decoder {name!r}")
+    return json.loads
+
+
+def _cookie_policy():
+    # Never persist cookies on the shared transport, the login flow passes the
+    # ones it needs explicitly. Imported here, it pulls in urllib and ssl.
+    import http.cookiejar
+
+    return http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+
+
+def _cookie_jar():
+    import http.cookiejar
+
+    return http.cookiejar.CookieJar(policy=_cookie_policy())
+
+
+class Deadline:
+    """Point in time by which a whole, possibly multi-step, operation must end.
+
+    Every request made on behalf of the operation gets at most the time that
+    is left, so a slow host fails the operation predictably instead of each
+    step getting a fresh timeout.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def timeout(self, connect_timeout, read_timeout):
+        """Return the (connect, read) timeout for the next request."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise MykoTimeout(f"Deadline of {self.seconds}s exceeded")
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+
+class MykoResponse:
+    """Transport independent view of a finished HTTP response.
+
+    ``json()`` decodes the body on first use with ``decoder`` and returns the
+    same object after that, callers must not modify it.
+    """
+
+    def __init__(self, status_code, headers, content, encoding, cookies, decoder=json.loads):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.cookies = cookies
+        self.decoder = decoder
+        self._json = _UNDECODED
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        if self._json is _UNDECODED:
+            self._json = self.decoder(self.content)
+        return self._json
+
+
+_UNDECODED = object()
+
+
+class RequestsTransport:
+    """Pooled HTTP/1.1 transport built on ``requests``."""
+
+    http_version = "HTTP/1.1"
+
+    def __init__(self, verify=True, pool_maxsize=POOL_MAXSIZE):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._errors = requests.exceptions.RequestException
+        self._timeout_errors = requests.exceptions.Timeout
+        self._verify = verify
+        self._session = requests.Session()
+        self._session.cookies.set_policy(_cookie_policy())
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        json=None,
+        headers=None,
+        cookies=None,
+        allow_redirects=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    ):
+        try:
+            r = self._session.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                json=json,
+                headers=headers,
+                cookies=cookies,
+                allow_redirects=allow_redirects,
+                verify=self._verify,
+                timeout=timeout,
+            )
+        except self._timeout_errors as ex:
+            raise MykoTimeout(f"{method} {url} timed out: {ex}") from ex
+        except self._errors as ex:
+            raise MykoConnectionError(f"{method} {url} failed: {ex}") from ex
+        r.close()
+        return MykoResponse(
+            r.status_code, r.headers, r.content, r.encoding, r.cookies.get_dict()
+        )
+
+    def close(self):
+        self._session.close()
+
+
+class Http2Transport:
+    """HTTP/2 transport built on ``httpx``, one multiplexed connection per host."""
+
+    http_version = "HTTP/2"
+
+    def __init__(self, verify=True):
+        import httpx
+
+        self._errors = httpx.HTTPError
+        self._timeout_errors = httpx.TimeoutException
+        self._timeout = httpx.Timeout
+        # Raises ImportError when the h2 extra is missing.
+        self._client = httpx.Client(
+            http2=True,
+            verify=verify,
+            cookies=_cookie_jar(),
+        )
+
+    def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        json=None,
+        headers=None,
+        cookies=None,
+        allow_redirects=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    ):
+        headers = dict(headers or {})
+        if cookies:
+            headers["cookie"] = "; ".join(
+                name + "=" + value for name, value in cookies.items()
+            )
+        try:
+            r = self._client.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                json=json,
+                headers=headers,
+                follow_redirects=allow_redirects,
+                timeout=self._timeout(timeout[1], connect=timeout[0]),
+            )
+        except self._timeout_errors as ex:
+            raise MykoTimeout(f"{method} {url} timed out: {ex}") from ex
+        except self._errors as ex:
+            raise MykoConnectionError(f"{method} {url} failed: {ex}") from ex
+        return MykoResponse(
+            r.status_code, r.headers, r.content, r.encoding, dict(r.cookies)
+        )
+
+    def close(self):
+        self._client.close()
+
+
+def create_transport(http2=False, verify=True):
+    """Return the HTTP/2 transport when requested and available, else HTTP/1.1."""
+    if http2:
+        try:
+            return Http2Transport(verify=verify)
+        except ImportError:
+            _LOGGER.warning(
+                "HTTP/2 requested but httpx[http2] is not installed, "
+                "falling back to pooled HTTP/1.1"
+            )
+    return RequestsTransport(verify=verify)
@@ -6,56 +6,111 @@ import sys
 import uuid
 import random
 
-parser = argparse.ArgumentParser(description = 'Anonymize the JSON output for Myko, so that it can be shared')
+# Everything is replaced in a single pass over the input with one combined
+# regex, so the cost is linear in the size of the dump. The input is read in
+# chunks and only the mapping tables grow with the number of unique values.
+CHUNK_SIZE = 1024 * 1024
+# Matches are never longer than this, so a chunk can be processed up to this
+# many characters before its end without cutting a match in half.
+TAIL_SIZE = 4096
 
-parser.add_argument('--infile', '-i', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
-parser.add_argument('--outfile', '-o', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
-args = parser.parse_args()
+# 13 digits includes dates since late 2001
+EPOCH_2001 = 10 ** 12
 
-infile = args.infile.read()
+combined_re = re.compile(
+	r'(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})'
+	r'|(?P<friendlyname>"friendlyName": ")(?P<name>[^"]*)"'
+	r'|(?P<ssid>"wifi-ssid")'
+	r'|(?P<value>"value": )(?P<quoted>"[^"]*")'
+	r'|(?P<othervalue>"value":)'
+	r'|(?P<functionclass>"functionClass":)'
+	r'|"(?P<mac>[0-9a-f]{12})"'
+	r'|"(?P<latlong>-?[0-9]{1,3}\.[0-9]*)"'
+	r'|(?P<time>[0-9]{13})'
+)
 
-# Replace UUIDs
-uuid_re = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
-unique_uuids = set(re.findall(uuid_re, infile))
-for unique_uuid in unique_uuids:
-	infile = infile.replace(unique_uuid, str(uuid.uuid4()))
 
-# Replace Times
-# 13 digits includes dates since late 2001
-# Keep times in relative order, add random value less than ~15 minutes
-time_re = re.compile('[0-9]{13}')
-unique_times = sorted(set(re.findall(time_re, infile)))
-random_increasing_offset = random.randint(1, 1000000)
-for unique_time in unique_times:
-	infile = infile.replace(unique_time, str(int(unique_time) + random_increasing_offset))
-	random_increasing_offset += random.randint(1, 1000000)
-
-# Replace Lat / Long
-latlong_re = re.compile('"(-?[0-9]{1,3}\.[0-9]*)"')
-unique_latlongs = set(re.findall(latlong_re, infile))
-for unique_latlong in unique_latlongs:
-	infile = infile.replace(unique_latlong, str(random.random()))
-
-# Replace Friendly Names
-friendlyname_re = re.compile('"friendlyName": "([^"]*)"')
-unique_friendlynames = set(re.findall(friendlyname_re, infile))
-i = 0
-for unique_friendlyname in unique_friendlynames:
-	infile = infile.replace(unique_friendlyname, 'Friendly Name ' + str(i))
-	i += 1
-
-# Replace MACs
-mac_re = re.compile('"([0-9a-f]{12})"')
-unique_macs = set(re.findall(mac_re, infile))
-for unique_mac in unique_macs:
-	infile = infile.replace(unique_mac, '%12x' % random.randrange(16**12))
-
-# Replace SSIDs
-ssid_re = re.compile('"wifi-ssid",.*?"value": "(.*?)"', re.DOTALL)
-unique_ssids = set(re.findall(ssid_re, infile))
-i = 0
-for unique_ssid in unique_ssids:
-	infile = infile.replace(unique_ssid, "SSID" + str(i))
-	i += 1
-
-args.outfile.write(infile)
+class Anonymizer:
+
+	def __init__(self):
+		self.uuids = {}
+		self.friendlynames = {}
+		self.latlongs = {}
+		self.macs = {}
+		self.ssids = {}
+		self.ssid_pending = False
+		# Keep times in relative order: shift them all by a random value less
+		# than ~15 minutes and stretch them by a random factor. The mapping is
+		# strictly increasing, so ordering holds without seeing every time first.
+		self.time_offset = random.randint(1, 1000000)
+		self.time_stretch = random.uniform(0, 0.001)
+
+	def _map(self, table, value, new_value):
+		if value not in table:
+			table[value] = new_value()
+		return table[value]
+
+	def _replace(self, match):
+		group = match.lastgroup
+		if group == 'uuid':
+			return self._map(self.uuids, match.group('uuid'), lambda: str(uuid.uuid4()))
+		if group == 'name':
+			name = self._map(self.friendlynames, match.group('name'), lambda: 'Friendly Name ' + str(len(self.friendlynames)))
+			return match.group('friendlyname') + name + '"'
+		if group == 'ssid':
+			self.ssid_pending = True
+			return match.group(0)
+		if group == 'quoted':
+			if self.ssid_pending:
+				self.ssid_pending = False
+				ssid = self._map(self.ssids, match.group('quoted'), lambda: 'SSID' + str(len(self.ssids)))
+				return match.group('value') + '"' + ssid + '"'
+			return match.group('value') + combined_re.sub(self._replace, match.group('quoted'))
+		if group in ('othervalue', 'functionclass'):
+			# A wifi-ssid without a string value (a description entry, or
+			# null), the next string belongs to something else.
+			self.ssid_pending = False
+			return match.group(0)
+		if group == 'mac':
+			return '"' + self._map(self.macs, match.group('mac'), lambda: '%12x' % random.randrange(16 ** 12)) + '"'
+		if group == 'latlong':
+			return '"' + self._map(self.latlongs, match.group('latlong'), lambda: str(random.random())) + '"'
+		if group == 'time':
+			time = int(match.group('time'))
+			return str(time + self.time_offset + int((time - EPOCH_2001) * self.time_stretch))
+		return match.group(0)
+
+	def anonymize(self, text):
+		"""Anonymize a complete document held in memory."""
+		return combined_re.sub(self._replace, text)
+
+	def anonymize_stream(self, infile, outfile, chunk_size=CHUNK_SIZE):
+		"""Anonymize infile into outfile, holding at most a couple of chunks."""
+		buffer = ''
+		while True:
+			chunk = infile.read(chunk_size)
+			buffer += chunk
+			safe = len(buffer) if not chunk else len(buffer) - TAIL_SIZE
+			position = 0
+			for match in combined_re.finditer(buffer):
+				if match.start() >= safe:
+					break
+				outfile.write(buffer[position:match.start()])
+				outfile.write(self._replace(match))
+				position = match.end()
+			if safe > position:
+				outfile.write(buffer[position:safe])
+				position = safe
+			buffer = buffer[position:]
+			if not chunk:
+				break
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Anonymize the JSON output for Myko, so that it can be shared')
+
+	parser.add_argument('--infile', '-i', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+	parser.add_argument('--outfile', '-o', nargs='?', type=argparse.FileType('w'), default=sys.stdout)
+	args = parser.parse_args()
+
+	Anonymizer().anonymize_stream(args.infile, args.outfile)
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Afero cloud used by ``Myko``.
+
+Implements the endpoints the integration talks to: the Keycloak style PKCE
+login (auth page, authenticate, token), ``/v1/users/me``, metadevices with and
+without ``expansions=state``, per device state GET/PUT and ``conclaveAccess``.
+The account is seeded from the dumps in ``sample_data`` and device state is
+mutable, so commands sent through ``set_state`` show up on the next poll.
+Like the real cloud, a change only moves the ``lastUpdateTime`` of the values,
+the metadevice ``version`` and ``updatedTimestampMs`` stay as they are.
+
+State can also be changed behind the client's back, as the Myko app does,
+with ``POST /_simulator/metadevices/<id>/state`` and the body of a state PUT,
+or ``AferoCloud.set_state`` in process.
+
+Latency, 429 throttling, 5xx errors and token expiry can be injected from the
+command line or changed at runtime with ``POST /_simulator/config``:
+
+    python tools/afero_simulator.py --port 8080 --latency 0.2 --error-rate 0.05
+
+Point the client at it with
+``Myko(user, password, api_url="http://127.0.0.1:8080", auth_url="http://127.0.0.1:8080")``.
+"""
+
+import argparse
+import base64
+import copy
+import hashlib
+import http.server
+import json
+import os
+import random
+import ssl
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from samples import load_samples  # noqa: E402
+
+REALM_PATH = "/auth/realms/kfi"
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class SimulatorConfig:
+    """Fault injection knobs, all of them safe to change while serving."""
+
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        throttle_rate=0.0,
+        error_rate=0.0,
+        token_ttl=120,
+        username=None,
+        password=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.username = username
+        self.password = password
+
+    def update(self, values):
+        for key, value in values.items():
+            if key.startswith("_") or not hasattr(self, key):
+                raise KeyError(key)
+            setattr(self, key, value)
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class AferoCloud:
+    """In memory account: metadevices, device state and issued tokens."""
+
+    def __init__(self, metadevices, config):
+        self.config = config
+        self.account_id = str(uuid.uuid4())
+        self._lock = threading.Lock()
+        self._metadevices = {}
+        self._states = {}
+        for metadevice in metadevices:
+            metadevice = copy.deepcopy(metadevice)
+            state = metadevice.pop("state", None)
+            self._metadevices[metadevice["id"]] = metadevice
+            if state is not None:
+                self._states[metadevice["id"]] = state
+        self._logins = {}
+        self._codes = {}
+        self._refresh_tokens = set()
+        self._tokens = {}
+        self.requests = 0
+
+    @classmethod
+    def from_samples(cls, config, directory=None):
+        metadevices = []
+        seen = set()
+        samples = load_samples() if directory is None else load_samples(directory)
+        for dump in samples.values():
+            for metadevice in dump:
+                if metadevice["id"] not in seen:
+                    seen.add(metadevice["id"])
+                    metadevices.append(metadevice)
+        return cls(metadevices, config)
+
+    # Authentication
+
+    def start_login(self, params):
+        session_code = uuid.uuid4().hex
+        self._logins[session_code] = params.get("code_challenge")
+        return session_code
+
+    def authenticate(self, session_code, username, password):
+        challenge = self._logins.pop(session_code, None)
+        if session_code is None or challenge is None:
+            return None
+        if self.config.username is not None and (
+            username != self.config.username or password != self.config.password
+        ):
+            return None
+        code = uuid.uuid4().hex
+        self._codes[code] = challenge
+        return code
+
+    def exchange_code(self, code, code_verifier):
+        challenge = self._codes.pop(code, None)
+        digest = hashlib.sha256((code_verifier or "").encode("utf-8")).digest()
+        expected = base64.urlsafe_b64encode(digest).decode("utf-8").replace("=", "")
+        if challenge is None or challenge != expected:
+            return None
+        refresh_token = uuid.uuid4().hex
+        self._refresh_tokens.add(refresh_token)
+        return refresh_token
+
+    def issue_token(self, refresh_token):
+        if refresh_token not in self._refresh_tokens:
+            return None
+        token = uuid.uuid4().hex
+        self._tokens[token] = time.monotonic() + self.config.token_ttl
+        return token
+
+    def token_valid(self, authorization):
+        if not authorization or not authorization.startswith("Bearer "):
+            return False
+        expires = self._tokens.get(authorization[len("Bearer "):])
+        return expires is not None and expires > time.monotonic()
+
+    # Devices
+
+    def metadevices(self, with_state):
+        with self._lock:
+            result = []
+            for metadevice_id, metadevice in self._metadevices.items():
+                metadevice = dict(metadevice)
+                if with_state and metadevice_id in self._states:
+                    metadevice["state"] = copy.deepcopy(self._states[metadevice_id])
+                result.append(metadevice)
+            return result
+
+    def get_state(self, metadevice_id):
+        with self._lock:
+            state = self._states.get(metadevice_id)
+            return copy.deepcopy(state) if state is not None else None
+
+    def set_state(self, metadevice_id, values):
+        """Apply values, a list as in a state PUT, and return the new state."""
+        with self._lock:
+            state = self._states.get(metadevice_id)
+            if state is None:
+                return None
+            now = _now_ms()
+            for new in values:
+                key = (new.get("functionClass"), new.get("functionInstance"))
+                for current in state["values"]:
+                    if (current.get("functionClass"), current.get("functionInstance")) == key:
+                        break
+                else:
+                    current = {"functionClass": key[0]}
+                    if key[1] is not None:
+                        current["functionInstance"] = key[1]
+                    state["values"].append(current)
+                current["value"] = new.get("value")
+                current["lastUpdateTime"] = now
+            return copy.deepcopy(state)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cloud(self):
+        return self.server.cloud
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("content-length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _form(self, body):
+        return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+    def _inject_faults(self):
+        config = self.cloud.config
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < config.throttle_rate:
+            self._send(429, {"error": "too many requests"}, headers={"retry-after": "1"})
+            return True
+        if random.random() < config.error_rate:
+            self._send(random.choice((500, 502, 503)), {"error": "injected failure"})
+            return True
+        return False
+
+    def _handle(self, method):
+        self.cloud.requests += 1
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self._read_body()
+
+        if path == "/_simulator/config":
+            if method == "POST":
+                try:
+                    self.cloud.config.update(json.loads(body or b"{}"))
+                except (KeyError, ValueError) as ex:
+                    return self._send(400, {"error": "unknown setting %s" % ex})
+            return self._send(200, self.cloud.config.as_dict())
+
+        if path.startswith("/_simulator/metadevices/") and path.endswith("/state"):
+            if method != "POST":
+                return self._send(405, {"error": "method not allowed"})
+            metadevice_id = path[len("/_simulator/metadevices/"):-len("/state")]
+            try:
+                values = json.loads(body or b"{}").get("values", [])
+            except ValueError:
+                return self._send(400, {"error": "invalid json"})
+            state = self.cloud.set_state(metadevice_id, values)
+            if state is None:
+                return self._send(404, {"error": "not found"})
+            return self._send(200, state)
+
+        if self._inject_faults():
+            return
+
+        if path == REALM_PATH + "/protocol/openid-connect/auth" and method == "GET":
+            session_code = self.cloud.start_login(query)
+            action = (
+                REALM_PATH + "/login-actions/authenticate?session_code=" + session_code
+                + "&execution=" + uuid.uuid4().hex
+                + "&client_id=" + query.get("client_id", "")
+                + "&tab_id=" + uuid.uuid4().hex[:11] + "&"
+            )
+            page = '<html><form id="kc-form-login" action="%s" method="post"></form></html>' % action
+            return self._send(200, page.encode("utf-8"), "text/html")
+
+        if path == REALM_PATH + "/login-actions/authenticate" and method == "POST":
+            form = self._form(body)
+            code = self.cloud.authenticate(
+                query.get("session_code"), form.get("username"), form.get("password")
+            )
+            if code is None:
+                return self._send(200, b"<html>Invalid username or password.</html>", "text/html")
+            location = (
+                "kfi-app://loginredirect?state=" + uuid.uuid4().hex
+                + "&session_state=" + str(uuid.uuid4()) + "&code=" + code
+            )
+            return self._send(302, headers={"location": location})
+
+        if path == REALM_PATH + "/protocol/openid-connect/token" and method == "POST":
+            form = self._form(body)
+            if form.get("grant_type") == "authorization_code":
+                refresh_token = self.cloud.exchange_code(form.get("code"), form.get("code_verifier"))
+            else:
+                refresh_token = form.get("refresh_token")
+            token = self.cloud.issue_token(refresh_token)
+            if token is None:
+                return self._send(400, {"error": "invalid_grant"})
+            return self._send(
+                200,
+                {
+                    "access_token": token,
+                    "id_token": token,
+                    "refresh_token": refresh_token,
+                    "expires_in": self.cloud.config.token_ttl,
+                    "token_type": "Bearer",
+                },
+            )
+
+        if not self.cloud.token_valid(self.headers.get("authorization")):
+            return self._send(401, {"error": "invalid token"})
+
+        if path == "/v1/users/me" and method == "GET":
+            return self._send(
+                200, {"accountAccess": [{"account": {"accountId": self.cloud.account_id}}]}
+            )
+
+        prefix = "/v1/accounts/" + self.cloud.account_id
+        if not path.startswith(prefix):
+            return self._send(404, {"error": "not found"})
+        path = path[len(prefix):]
+
+        if path == "/metadevices" and method == "GET":
+            with_state = "state" in query.get("expansions", "").split(",")
+            return self._send(200, self.cloud.metadevices(with_state))
+
+        if path.startswith("/metadevices/") and path.endswith("/state"):
+            metadevice_id = path[len("/metadevices/"):-len("/state")]
+            if method == "GET":
+                state = self.cloud.get_state(metadevice_id)
+            elif method == "PUT":
+                state = self.cloud.set_state(metadevice_id, json.loads(body).get("values", []))
+            else:
+                return self._send(405, {"error": "method not allowed"})
+            if state is None:
+                return self._send(404, {"error": "not found"})
+            return self._send(200, state)
+
+        if path == "/conclaveAccess" and method == "POST":
+            return self._send(
+                200,
+                {
+                    "conclave": {"host": "127.0.0.1", "port": self.server.server_address[1]},
+                    "tokens": [
+                        {"token": uuid.uuid4().hex, "expiresTimestamp": _now_ms() + 3600 * 1000}
+                    ],
+                },
+            )
+
+        return self._send(404, {"error": "not found"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+class AferoSimulator(http.server.ThreadingHTTPServer):
+    """Threaded HTTP(S) server around an ``AferoCloud``."""
+
+    daemon_threads = True
+
+    def __init__(self, cloud, host="127.0.0.1", port=0, ssl_context=None, verbose=False):
+        super().__init__((host, port), _Handler)
+        self.cloud = cloud
+        self.verbose = verbose
+        self.scheme = "http"
+        if ssl_context is not None:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+            self.scheme = "https"
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "%s://%s:%d" % (self.scheme, host, port)
+
+    def start(self):
+        """Serve from a daemon thread and return the base url."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Afero cloud")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--samples", default=None, help="directory with account dumps")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this much")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 5xx")
+    parser.add_argument("--token-ttl", type=float, default=120, help="id token lifetime in seconds")
+    parser.add_argument("--username", default=None, help="only accept this user (default: any)")
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--tls-cert", default=None)
+    parser.add_argument("--tls-key", default=None)
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        token_ttl=args.token_ttl,
+        username=args.username,
+        password=args.password,
+    )
+    cloud = AferoCloud.from_samples(config, args.samples)
+    context = None
+    if args.tls_cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.tls_cert, args.tls_key)
+    server = AferoSimulator(cloud, args.host, args.port, context, args.verbose)
+    print("Serving account %s on %s" % (cloud.account_id, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Compare the JSON decoders ``Myko`` can use on real response bodies.
+
+The bodies are the dumps in ``sample_data`` plus a synthetic account listing
+of ``--devices`` devices (see ``synthetic_account.py``), which is what
+``getMetadeviceInfo`` returns for a large account. Every decoder that
+``json_decoder`` knows and that is installed is timed, best of ``--runs``.
+
+    python tools/bench_json.py --devices 1000 --runs 20
+
+The last rows show what decoding each response once saves: the old
+``getConclave`` decoded its body four times.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from samples import load_samples  # noqa: E402
+from synthetic_account import generate_account  # noqa: E402
+from myko.transport import MykoResponse, json_decoder  # noqa: E402
+
+DECODERS = ["json", "orjson"]
+
+
+def best(fn, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    decoders = {}
+    for name in DECODERS:
+        try:
+            decoders[name] = json_decoder(name)
+        except ImportError:
+            print(f"{name} is not installed, skipped")
+
+    bodies = {name: json.dumps(dump).encode() for name, dump in load_samples().items()}
+    bodies[f"synthetic {args.devices}"] = json.dumps(generate_account(args.devices)).encode()
+
+    names = list(decoders)
+    print(f"{'body':32} {'KiB':>8}" + "".join(f" {name + ' ms':>10}" for name in names) + f" {'speedup':>8}")
+    for label, body in bodies.items():
+        times = [best(lambda: decode(body), args.runs) for decode in decoders.values()]
+        speedup = times[0] / times[-1]
+        print(
+            f"{label:32} {len(body) / 1024:8.1f}"
+            + "".join(f" {seconds * 1000:10.3f}" for seconds in times)
+            + f" {speedup:7.1f}x"
+        )
+
+    body = bodies[f"synthetic {args.devices}"]
+    for name, decode in decoders.items():
+
+        def four_calls():
+            r = MykoResponse(200, {}, body, "utf-8", {}, decoder=decode)
+            for _ in range(4):
+                r.json()
+
+        def four_decodes():
+            for _ in range(4):
+                decode(body)
+
+        print(
+            f"4x json() {name:22} once {best(four_calls, args.runs) * 1000:.3f} ms,"
+            f" every call {best(four_decodes, args.runs) * 1000:.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""How the parse and decode path scales with the size of the account.
+
+For each account size a synthetic account (see ``synthetic_account.py``) is
+served as canned responses to a ``Myko`` client that logged in against the
+in-process simulator, so only decoding and parsing is measured, not the
+network. Stages:
+
+  decode        decode of the ``expansions=state`` listing, with orjson when installed
+  discover      catalog decode plus ``discoverDeviceIds``
+  poll full     first ``poll_changes``, every device is new
+  poll same     second ``poll_changes``, nothing changed
+  state dicts   ``_state_response_to_state_dict`` for every device
+  apply         ``MykoLight.apply_state`` for every light (needs homeassistant)
+
+    python tools/bench_scale.py --sizes 1000 2000 5000 10000
+
+Times come from a run without tracemalloc, peak memory from a second run
+with it.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from afero_simulator import AferoCloud, AferoSimulator, SimulatorConfig  # noqa: E402
+from synthetic_account import generate_account, sample_devices  # noqa: E402
+from myko.myko import Myko  # noqa: E402
+from myko.transport import MykoResponse  # noqa: E402
+
+try:
+    from myko.light import MykoLight, _is_light
+except ImportError:
+    MykoLight = None
+
+
+def _response(body, decoder=json.loads):
+    return MykoResponse(200, {}, body, "utf-8", {}, decoder=decoder)
+
+
+class Stages:
+    def __init__(self, account, myko):
+        listing = [dict(metadevice) for metadevice in account]
+        catalog = [dict(metadevice) for metadevice in account]
+        for metadevice in catalog:
+            metadevice.pop("state", None)
+        self.devices = [m for m in account if m.get("typeId") == "metadevice.device"]
+        self.listing_body = json.dumps(listing).encode()
+        self.catalog_body = json.dumps(catalog).encode()
+        self.state_bodies = [
+            json.dumps(device.get("state", {"values": []})).encode()
+            for device in self.devices
+        ]
+        self.myko = myko
+
+        def getMetadeviceInfo(deadline=None, state=True):
+            return _response(
+                self.listing_body if state else self.catalog_body, myko._decoder
+            )
+
+        myko.getMetadeviceInfo = getMetadeviceInfo
+
+    def decode(self):
+        self.myko._decoder(self.listing_body)
+
+    def discover(self):
+        self.myko.getCatalog(refresh=True)
+        self.discovered = list(self.myko.discoverDeviceIds())
+
+    def poll_full(self):
+        self.myko._value_times = {}
+        self.myko._states = {}
+        self.changed = self.myko.poll_changes()
+
+    def poll_same(self):
+        self.myko.poll_changes()
+
+    def state_dicts(self):
+        # Fresh responses each run, a response decodes its body only once.
+        self.states = [
+            self.myko._state_response_to_state_dict(_response(body, self.myko._decoder))
+            for body in self.state_bodies
+        ]
+
+    def apply(self):
+        for light, state in self.lights:
+            light.apply_state(state)
+
+    def prepare_apply(self):
+        self.lights = []
+        for childId, model, deviceId, deviceClass, name, functions in self.discovered:
+            if _is_light(deviceClass, functions):
+                light = MykoLight(
+                    self.myko, name, False, childId, model, deviceId, deviceClass, functions
+                )
+                self.lights.append((light, self.myko.get_cached_state(childId) or {}))
+
+
+STAGES = [
+    ("decode", "decode"),
+    ("discover", "discover"),
+    ("poll full", "poll_full"),
+    ("poll same", "poll_same"),
+    ("state dicts", "state_dicts"),
+    ("apply", "apply"),
+]
+
+
+def run(stages, memory):
+    results = {}
+    for label, name in STAGES:
+        if name == "apply":
+            if MykoLight is None:
+                continue
+            stages.prepare_apply()
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        getattr(stages, name)()
+        elapsed = time.perf_counter() - start
+        if memory:
+            results[label] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            results[label] = elapsed
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000])
+    args = parser.parse_args()
+
+    # A real login against the simulator, the payloads are swapped in after.
+    url = AferoSimulator(AferoCloud.from_samples(SimulatorConfig())).start()
+    templates = sample_devices()
+    if MykoLight is None:
+        print("homeassistant is not installed, skipping the apply stage\n")
+
+    print(f"{'devices':>8} {'stage':12} {'seconds':>9} {'us/device':>10} {'peak MiB':>9}")
+    for size in args.sizes:
+        account = generate_account(size, templates=templates)
+        myko = Myko("user", "password", api_url=url, auth_url=url)
+        stages = Stages(account, myko)
+        times = run(stages, memory=False)
+        peaks = run(stages, memory=True)
+        for label, seconds in times.items():
+            print(
+                f"{size:8} {label:12} {seconds:9.3f} {seconds / size * 1e6:10.1f}"
+                f" {peaks[label] / 2 ** 20:9.1f}"
+            )
+        print(f"{size:8} {'payload':12} {len(stages.listing_body) / 2 ** 20:9.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Compare the pooled HTTP/1.1 transport with the HTTP/2 one.
+
+Starts two local TLS stand-in servers (one speaking HTTP/1.1, one HTTP/2) that
+answer the paths ``Myko`` uses with a canned payload after a configurable
+latency, then replays poll cycles against both: a burst of state GETs, a few
+state PUTs and a token refresh per cycle. Failed requests are counted and
+reported next to the timings of the others.
+
+    python tools/bench_transport.py --devices 30 --cycles 20 --latency 0.05
+
+Needs ``openssl`` on the path for the throw-away certificate and
+``httpx[http2]`` for the HTTP/2 side.
+"""
+
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from myko.transport import Http2Transport, RequestsTransport  # noqa: E402
+
+STATE_BODY = json.dumps(
+    {
+        "metadeviceId": "00000000-0000-0000-0000-000000000000",
+        "values": [
+            {"functionClass": "power", "lastUpdateTime": 1669828901056, "value": "on"},
+            {"functionClass": "brightness", "lastUpdateTime": 1669829667929, "value": 29},
+            {"functionClass": "color-temperature", "lastUpdateTime": 1669829852328, "value": "3000K"},
+        ],
+    }
+).encode()
+TOKEN_BODY = json.dumps({"id_token": "token", "refresh_token": "refresh"}).encode()
+
+
+def _body_for(path):
+    if "openid-connect/token" in path:
+        return TOKEN_BODY
+    return STATE_BODY
+
+
+def _make_cert(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+class _Http1Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        length = int(self.headers.get("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.latency)
+        body = _body_for(self.path)
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Http1Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context, latency):
+        super().__init__(("127.0.0.1", 0), _Http1Handler)
+        self.latency = latency
+        self.connections = 0
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class _H2Protocol(asyncio.Protocol):
+    def __init__(self, server):
+        import h2.config
+        import h2.connection
+
+        self._server = server
+        self._conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        self._paths = {}
+        # Response bodies waiting for the client to open its flow control
+        # window, by stream.
+        self._blocked = {}
+
+    def connection_made(self, transport):
+        self._server.connections += 1
+        self._transport = transport
+        self._conn.initiate_connection()
+        transport.write(self._conn.data_to_send())
+
+    def data_received(self, data):
+        import h2.events
+        import h2.exceptions
+
+        try:
+            events = self._conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            # h2 queued a GOAWAY, the client fails the open streams and
+            # reconnects. Happens when httpcore writes the headers of two
+            # new streams out of order from different threads.
+            self._transport.write(self._conn.data_to_send())
+            self._transport.close()
+            return
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                self._paths[event.stream_id] = dict(event.headers)[":path"]
+            elif isinstance(event, h2.events.DataReceived):
+                self._conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id
+                )
+            elif isinstance(event, h2.events.StreamEnded):
+                path = self._paths.pop(event.stream_id, None)
+                if path is not None:
+                    asyncio.get_running_loop().call_later(
+                        self._server.latency, self._respond, event.stream_id, path
+                    )
+            elif isinstance(event, h2.events.StreamReset):
+                self._paths.pop(event.stream_id, None)
+                self._blocked.pop(event.stream_id, None)
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._send_blocked(event.stream_id)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self._transport.write(self._conn.data_to_send())
+                self._transport.close()
+                return
+        self._transport.write(self._conn.data_to_send())
+
+    def _respond(self, stream_id, path):
+        import h2.exceptions
+
+        if self._transport.is_closing():
+            return
+        body = _body_for(path)
+        try:
+            self._conn.send_headers(
+                stream_id,
+                [
+                    (":status", "200"),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(body))),
+                ],
+            )
+        except h2.exceptions.ProtocolError:
+            # Reset by the client or the connection is going away.
+            return
+        self._blocked[stream_id] = body
+        self._send_blocked(stream_id)
+
+    def _send_blocked(self, stream_id):
+        """Send what the flow control windows allow, all streams when stream_id is 0."""
+        import h2.exceptions
+
+        for stream in list(self._blocked) if stream_id == 0 else [stream_id]:
+            body = self._blocked.get(stream)
+            if body is None:
+                continue
+            try:
+                size = min(
+                    self._conn.local_flow_control_window(stream),
+                    self._conn.max_outbound_frame_size,
+                    len(body),
+                )
+                if size or not body:
+                    self._conn.send_data(stream, body[:size], end_stream=size == len(body))
+            except h2.exceptions.ProtocolError:
+                self._blocked.pop(stream, None)
+                continue
+            if size == len(body):
+                del self._blocked[stream]
+            else:
+                self._blocked[stream] = body[size:]
+        if not self._transport.is_closing():
+            self._transport.write(self._conn.data_to_send())
+
+
+class _Http2Server:
+    def __init__(self, context, latency):
+        self.latency = latency
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            self._loop.create_server(
+                lambda: _H2Protocol(self), "127.0.0.1", 0, ssl=context
+            )
+        )
+        self.server_address = self._server.sockets[0].getsockname()
+
+    def serve_forever(self):
+        self._loop.run_forever()
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def _server_context(cert, key, protocol):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    context.set_alpn_protocols([protocol])
+    return context
+
+
+def _run_cycles(transport, base_url, devices, cycles, concurrency):
+    """Return cycle times, latencies of the successful requests and the errors of the others."""
+    latencies = []
+    errors = []
+
+    def call(method, path, **kwargs):
+        start = time.perf_counter()
+        r = transport.request(method, base_url + path, **kwargs)
+        r.json()
+        latencies.append(time.perf_counter() - start)
+
+    cycle_times = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(cycles):
+            start = time.perf_counter()
+            jobs = [
+                pool.submit(
+                    call,
+                    "POST",
+                    "/auth/realms/kfi/protocol/openid-connect/token",
+                    data={"grant_type": "refresh_token"},
+                )
+            ]
+            for device in range(devices):
+                path = "/v1/accounts/account/metadevices/%d/state" % device
+                jobs.append(pool.submit(call, "GET", path))
+            for device in range(min(3, devices)):
+                path = "/v1/accounts/account/metadevices/%d/state" % device
+                jobs.append(
+                    pool.submit(call, "PUT", path, json={"values": [{"value": "on"}]})
+                )
+            for job in jobs:
+                try:
+                    job.result()
+                except Exception as ex:
+                    # Count it and go on, httpcore lets some errors of a
+                    # connection going away through unwrapped (KeyError).
+                    errors.append(ex)
+            cycle_times.append(time.perf_counter() - start)
+    return cycle_times, latencies, errors
+
+
+def _report(name, server, cycle_times, latencies, errors):
+    if not latencies:
+        print("%-9s all %d requests failed: %s" % (name, len(errors), errors[0]))
+        return
+    latencies = sorted(latencies)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(
+        "%-9s cycle mean %7.1f ms  request p50 %6.1f ms  p95 %6.1f ms  connections %d  failed %d"
+        % (
+            name,
+            statistics.mean(cycle_times) * 1000,
+            statistics.median(latencies) * 1000,
+            p95 * 1000,
+            server.connections,
+            len(errors),
+        )
+    )
+    if errors:
+        print("%-9s first failure: %s" % ("", errors[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=30)
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = _make_cert(directory)
+        servers = [
+            ("HTTP/1.1", _Http1Server(_server_context(cert, key, "http/1.1"), args.latency), RequestsTransport),
+            ("HTTP/2", _Http2Server(_server_context(cert, key, "h2"), args.latency), Http2Transport),
+        ]
+        for name, server, transport_class in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = "https://127.0.0.1:%d" % server.server_address[1]
+            transport = transport_class(verify=False)
+            # Warm up so connection setup is not part of the first cycle.
+            _run_cycles(transport, base_url, 1, 1, 1)
+            cycle_times, latencies, errors = _run_cycles(
+                transport, base_url, args.devices, args.cycles, args.concurrency
+            )
+            transport.close()
+            server.shutdown()
+            _report(name, server, cycle_times, latencies, errors)
+
+
+if __name__ == "__main__":
+    main()
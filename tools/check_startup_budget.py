@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Check that importing the integration and setting up an account stay fast.
+
+Two measurements, each against a budget:
+
+  import   a fresh interpreter imports the ``myko`` modules, best of a few
+           runs. With homeassistant installed that includes the light, sensor
+           and switch platforms, timed after the homeassistant modules they
+           use are loaded, so only the cost of the integration counts.
+  setup    an account of ``--devices`` devices served by the in-process
+           simulator. With homeassistant installed that is ``_setup_account``
+           (login, discovery, creating the entities and groups), else login
+           and discovery only.
+
+    python tools/check_startup_budget.py --import-budget 150 --setup-budget 2
+
+Exits non-zero if a budget is exceeded, the CI workflow runs it with and
+without homeassistant. Inside Home Assistant modules like asyncio, ssl and
+requests are usually loaded already, so the import time there is lower than
+measured here.
+"""
+
+import argparse
+import functools
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_components"))
+
+from afero_simulator import AferoCloud, AferoSimulator, SimulatorConfig  # noqa: E402
+from synthetic_account import generate_account  # noqa: E402
+
+MODULES = [
+    "myko.myko",
+    "myko.transport",
+    "myko.executor",
+    "myko.ratelimit",
+    "myko.profiling",
+    "myko.hedging",
+]
+
+PLATFORM_MODULES = ["myko.light", "myko.sensor", "myko.switch"]
+
+# What the platforms import from homeassistant, loaded before timing starts.
+HA_MODULES = [
+    "voluptuous",
+    "homeassistant.components.light",
+    "homeassistant.components.sensor",
+    "homeassistant.components.switch",
+    "homeassistant.helpers.config_validation",
+    "homeassistant.helpers.discovery",
+    "homeassistant.helpers.entity_platform",
+    "homeassistant.helpers.entity_registry",
+    "homeassistant.helpers.event",
+    "homeassistant.helpers.restore_state",
+]
+
+HAS_HA = importlib.util.find_spec("homeassistant") is not None
+
+IMPORT_RUNS = 5
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {path!r})
+{preload}
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+"""
+
+
+def import_seconds():
+    """Best of ``IMPORT_RUNS`` imports of the modules in a fresh interpreter."""
+    modules = MODULES + (PLATFORM_MODULES if HAS_HA else [])
+    script = IMPORT_SCRIPT.format(
+        path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components"),
+        preload="\n".join(f"import {module}" for module in HA_MODULES) if HAS_HA else "",
+        imports="\n".join(f"import {module}" for module in modules),
+    )
+    runs = [
+        float(subprocess.check_output([sys.executable, "-c", script], text=True))
+        for _ in range(IMPORT_RUNS)
+    ]
+    return min(runs)
+
+
+def setup_timings(devices):
+    """Startup phases of one account of ``devices`` devices on the simulator."""
+    from myko.myko import Myko
+
+    cloud = AferoCloud(generate_account(devices), SimulatorConfig())
+    url = AferoSimulator(cloud).start()
+    if HAS_HA:
+        return platform_timings(functools.partial(Myko, api_url=url, auth_url=url))
+    start = time.perf_counter()
+    myko = Myko("user", "password", api_url=url, auth_url=url)
+    with myko.startup.phase("discovery"):
+        list(myko.discoverDeviceIds())
+    myko.startup.timings["total"] = round(time.perf_counter() - start, 4)
+    return myko.startup.timings
+
+
+def platform_timings(client):
+    """Run ``_setup_account`` of the light platform with ``client`` as Myko."""
+    from myko import light
+    from myko.ratelimit import RateLimiter
+
+    light.Myko = client
+    config = light.PLATFORM_SCHEMA(
+        {"platform": light.DOMAIN, "username": "user", "password": "password", "groups": True}
+    )
+    data = {
+        "transports": {},
+        "rate_limiter": RateLimiter(config[light.CONF_RATE_LIMIT]),
+        "accounts": {},
+        "entities": [],
+        "scenes": {},
+    }
+    light._setup_account(data, config, "user", "password")
+    return data["accounts"]["user"]["myko"].startup.timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--import-budget", type=float, default=150, help="milliseconds")
+    parser.add_argument("--setup-budget", type=float, default=2, help="seconds")
+    parser.add_argument("--devices", type=int, default=200)
+    args = parser.parse_args()
+
+    failed = False
+    if not HAS_HA:
+        print("homeassistant is not installed, leaving out the platforms\n")
+    imported = import_seconds() * 1000
+    ok = imported <= args.import_budget
+    failed |= not ok
+    print(f"import  {imported:8.1f} ms  budget {args.import_budget:g} ms  {'ok' if ok else 'OVER'}")
+
+    timings = setup_timings(args.devices)
+    ok = timings["total"] <= args.setup_budget
+    failed |= not ok
+    phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+    print(f"setup   {timings['total']:8.3f} s   budget {args.setup_budget:g} s  {'ok' if ok else 'OVER'}")
+    print(f"        {phases}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
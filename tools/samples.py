@@ -0,0 +1,30 @@
+"""Helpers for loading the account dumps in ``sample_data``.
+
+The dumps were pasted from ``TestMyko.py`` output by hand, so a few of them
+carry the banner line or lost their opening bracket. ``load_sample`` tolerates
+both and always returns the list of metadevices.
+"""
+
+import glob
+import json
+import os
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), "..", "sample_data")
+
+
+def load_sample(path):
+    with open(path) as f:
+        text = f.read()
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    text = text[min(starts):]
+    if text.startswith("{"):
+        text = "[" + text.rstrip().rstrip(",") + "]"
+    return json.loads(text)
+
+
+def load_samples(directory=SAMPLE_DIR):
+    """Return ``{file name: [metadevice, ...]}`` for every dump in ``directory``."""
+    samples = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        samples[os.path.basename(path)] = load_sample(path)
+    return samples
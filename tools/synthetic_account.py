@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Build large synthetic Myko accounts from the dumps in ``sample_data``.
+
+Every generated device is a copy of one of the sample devices, cycling
+through them so device classes stay mixed, with fresh ids, a unique friendly
+name and spread out value update times. The device ``version`` and
+``updatedTimestampMs`` stay as in the dumps, the cloud does not move them
+when state changes. Devices are put in rooms of ``room_size`` under one
+home, like the app does.
+
+    python tools/synthetic_account.py --devices 5000 -o /tmp/account.json
+
+The result has the shape of ``/metadevices?expansions=state`` and can seed the
+simulator directly: ``AferoCloud(generate_account(5000), SimulatorConfig())``.
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from samples import load_samples  # noqa: E402
+
+ROOM_SIZE = 25
+
+
+def sample_devices(directory=None):
+    """Every distinct ``metadevice.device`` in the sample dumps."""
+    samples = load_samples() if directory is None else load_samples(directory)
+    devices = {}
+    for dump in samples.values():
+        for metadevice in dump:
+            if metadevice.get("typeId") == "metadevice.device":
+                devices.setdefault(metadevice["id"], metadevice)
+    return list(devices.values())
+
+
+def _group(type_id, name, children, now):
+    return {
+        "children": children,
+        "createdTimestampMs": now,
+        "description": {},
+        "friendlyName": name,
+        "id": str(uuid.uuid4()),
+        "typeId": type_id,
+        "updatedTimestampMs": now,
+        "version": 1,
+    }
+
+
+def generate_account(devices, room_size=ROOM_SIZE, seed=0, templates=None):
+    """Return the metadevice list of an account with ``devices`` devices."""
+    rng = random.Random(seed)
+    templates = templates or sample_devices()
+    now = 1700000000000
+    metadevices = []
+    rooms = []
+    room_children = []
+    for index in range(devices):
+        template = templates[index % len(templates)]
+        device = copy.deepcopy(template)
+        device["id"] = str(uuid.UUID(int=rng.getrandbits(128)))
+        device["deviceId"] = "%016x" % rng.getrandbits(64)
+        device["friendlyName"] = f"{template.get('friendlyName', 'Device')} {index}"
+        state = device.get("state")
+        if state is not None:
+            state["metadeviceId"] = device["id"]
+            for value in state.get("values", []):
+                value["lastUpdateTime"] = now - rng.randint(0, 10 ** 9)
+        metadevices.append(device)
+        room_children.append(device["id"])
+        if len(room_children) == room_size or index == devices - 1:
+            rooms.append(
+                _group("metadevice.room", f"Room {len(rooms)}", room_children, now)
+            )
+            room_children = []
+    home = _group("metadevice.home", "Home", [room["id"] for room in rooms], now)
+    return [home] + rooms + metadevices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--room-size", type=int, default=ROOM_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--outfile", "-o", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args()
+    json.dump(generate_account(args.devices, args.room_size, args.seed), args.outfile)
+
+
+if __name__ == "__main__":
+    main()